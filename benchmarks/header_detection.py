@@ -0,0 +1,78 @@
+'''
+Compare header detection on the full sheet with the streaming mode that only reads the first rows.
+
+Usage (from the repository root):
+    python benchmarks/header_detection.py [--data-dir data] [--repeat 5] [--rows 200000]
+
+--rows additionally generates a sales-like workbook with the given number of data rows,
+to show that the streaming mode does not depend on the size of the sheet.
+'''
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from excel_preparations import ExcelPreparations
+
+
+def write_large_workbook(path: str, rows: int) -> None:
+    # written with XlsxWriter like Excel does, including the <dimension> element openpyxl needs to stream a sheet
+    # without scanning it (openpyxl's own write-only mode omits it)
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(path, {"constant_memory": True})
+    sheet = workbook.add_worksheet()
+    sheet.write_row(0, 0, ["Sales data for CH, Switzerland, 2023"])
+    sheet.write_row(1, 0, ["Month", "Material", "Units Sold", "Total Sales ($)"])
+    months = ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December"]
+    for i in range(rows):
+        sheet.write_row(i + 2, 0, [months[i % 12], f"Material {i % 40}", i % 1000, (i % 1000) * 45])
+    workbook.close()
+
+
+def time_call(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--rows", type=int, default=0)
+    args = parser.parse_args()
+
+    files = sorted(os.path.join(args.data_dir, f) for f in os.listdir(args.data_dir) if f.endswith(".xlsx"))
+    tmp_dir = tempfile.TemporaryDirectory()
+    if args.rows:
+        large_file = os.path.join(tmp_dir.name, f"Sales data_synthetic_{args.rows}.xlsx")
+        write_large_workbook(large_file, args.rows)
+        files.append(large_file)
+
+    excel_preparation = ExcelPreparations()
+    print(f"{'file':<60} {'full (ms)':>10} {'streaming (ms)':>15} {'speedup':>8}")
+    total_full = total_streaming = 0
+    for file in files:
+        full_header = excel_preparation.detect_header_index(file, max_rows=None)
+        streaming_header = excel_preparation.detect_header_index(file)
+        assert full_header == streaming_header, f"Header mismatch for {file}: {full_header} != {streaming_header}"
+
+        full = time_call(lambda: excel_preparation.detect_header_index(file, max_rows=None), args.repeat)
+        streaming = time_call(lambda: excel_preparation.detect_header_index(file), args.repeat)
+        total_full += full
+        total_streaming += streaming
+        print(f"{os.path.basename(file):<60} {full * 1000:>10.1f} {streaming * 1000:>15.1f} {full / streaming:>7.1f}x")
+
+    print(f"{'total':<60} {total_full * 1000:>10.1f} {total_streaming * 1000:>15.1f} {total_full / total_streaming:>7.1f}x")
+    tmp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+'''
+Compare the parse time of the workbooks with every installed reader engine, see reader_engines.py.
+
+Usage (from the repository root):
+    python benchmarks/reader_engines.py [--data-dir data] [--repeat 5]
+
+Engines that are not installed (pip install python-calamine / xlrd) or can not read a file are shown as "-".
+The data frames of all engines are checked against each other, so a faster engine can not silently parse differently.
+'''
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from excel_preparations import ExcelPreparations
+from reader_engines import ENGINES, available_engines, select_engine
+
+
+def time_call(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    files = sorted(os.path.join(args.data_dir, f) for f in os.listdir(args.data_dir) if f.endswith((".xlsx", ".xls")))
+    engines = available_engines()
+    print(f"installed engines: {', '.join(engines)} (not installed: {', '.join(e for e in ENGINES if e not in engines) or '-'})")
+
+    print(f"{'file':<50} {'auto':>10}" + "".join(f" {engine + ' (ms)':>16}" for engine in engines))
+    totals = {engine: 0.0 for engine in engines}
+    for file in files:
+        results = {}
+        for engine in engines:
+            if not ENGINES[engine].can_read(file):
+                continue
+            excel_preparation = ExcelPreparations(use_sidecar=False, engine=engine)
+            results[engine] = (excel_preparation.parse_file(file), time_call(lambda: excel_preparation.parse_file(file), args.repeat))
+            totals[engine] += results[engine][1]
+
+        (reference_df, reference_info), _ = next(iter(results.values()))
+        for engine, ((df, info_text), _) in results.items():
+            assert df.equals(reference_df) and info_text == reference_info, f"{engine} parses {file} differently"
+
+        cells = "".join(f" {results[engine][1] * 1000:>16.1f}" if engine in results else f" {'-':>16}" for engine in engines)
+        print(f"{os.path.basename(file):<50} {select_engine(file).name:>10}" + cells)
+
+    print(f"{'total':<50} {'':>10}" + "".join(f" {totals[engine] * 1000:>16.1f}" for engine in engines))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import os
+import hashlib
+import threading
+
+CHUNK_SIZE = 1024 * 1024
+
+
+'''
+Computes the checksum of a file once per file version.
+Files are hashed in chunks, so they are never read into memory as a whole. As long as size, mtime and inode
+of a file are unchanged, the digest computed before is returned without reading the file again.
+'''
+class ChecksumService():
+    def __init__(self):
+        self._digests = {} # path -> ((size, mtime_ns, inode), digest)
+        self._lock = threading.Lock()
+
+    def checksum(self, path: str) -> str:
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        version = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        with self._lock:
+            cached = self._digests.get(path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        md5 = hashlib.md5()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                md5.update(chunk)
+        digest = md5.hexdigest()
+        with self._lock:
+            self._digests[path] = (version, digest)
+        return digest
+
+    def forget(self, path: str) -> None:
+        with self._lock:
+            self._digests.pop(os.path.abspath(path), None)
+
+
+checksum_service = ChecksumService()
+
+def file_checksum(path: str) -> str:
+    return checksum_service.checksum(path)
@@ -0,0 +1,195 @@
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from checksums import file_checksum
+
+
+class FileIdentity():
+    def __init__(self, path: str, size: int, mtime_ns: int, checksum: str = None):
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.checksum = checksum
+
+    @classmethod
+    def from_path(cls, path: str) -> "FileIdentity":
+        stat = os.stat(path)
+        return cls(path, stat.st_size, stat.st_mtime_ns)
+
+    def same_stat(self, other: "FileIdentity") -> bool:
+        return self.path == other.path and self.size == other.size and self.mtime_ns == other.mtime_ns
+
+
+class CacheEntry():
+    def __init__(self, identity: FileIdentity, data_frame, metadata: dict):
+        self.identity = identity
+        self.data_frame = data_frame # None until the data frame is loaded
+        self.metadata = metadata
+
+
+'''
+Read-only mapping of filenames to data frames, a data frame is only loaded when it is accessed for the first time.
+Checking for a filename, iterating or counting the files does not load anything.
+'''
+class LazyDataFrames(Mapping):
+    def __init__(self, cache: "DataCache", filenames: list):
+        self._cache = cache
+        self._filenames = list(filenames)
+
+    def __getitem__(self, filename: str):
+        if filename not in self._filenames:
+            raise KeyError(filename)
+        return self._cache.load([filename])[filename]
+
+    def __contains__(self, filename) -> bool:
+        return filename in self._filenames
+
+    def __iter__(self):
+        return iter(self._filenames)
+
+    def __len__(self) -> int:
+        return len(self._filenames)
+
+    def preload(self, filenames: list = None) -> None:
+        # load several data frames at once, so they are parsed in parallel
+        self._cache.load([f for f in (self._filenames if filenames is None else filenames) if f in self._filenames])
+
+
+'''
+Process-wide cache of the metadata of all files and their parsed and preprocessed data frames.
+Entries are keyed by filename and validated against the file identity (path, size, mtime, checksum),
+so a changed file only invalidates its own entry. Data frames are loaded by the loader on first access
+(see LazyDataFrames), the least recently used data frames are unloaded again once more than max_entries
+data frames are loaded. The metadata of a file stays cached until the file changes or is removed.
+Structures derived from a set of files (e.g. the sales fact table) are built once per version of these files.
+'''
+class DataCache():
+    def __init__(self, max_entries: int = 64, loader=None):
+        self.max_entries = max_entries
+        self.loader = loader # loader(entries) returns the data frames of the given {filename: CacheEntry}
+        self._entries = OrderedDict()
+        self._derived = {} # name -> (file versions, value)
+        self._lock = threading.RLock()
+        self._load_locks = {} # filename -> lock, a data frame is loaded only once, even if requested concurrently
+
+    def __contains__(self, filename: str) -> bool:
+        return filename in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def is_fresh(self, filename: str, path: str) -> bool:
+        with self._lock:
+            entry = self._entries.get(filename)
+        if entry is None:
+            return False
+        try:
+            current = FileIdentity.from_path(path)
+        except OSError:
+            return False
+        if not entry.identity.same_stat(current):
+            # size or mtime changed, the content might still be the same (e.g. file was touched or copied again)
+            current.checksum = file_checksum(path) # hashed without holding the lock
+            if current.checksum != entry.identity.checksum:
+                return False
+            entry.identity = current
+        with self._lock:
+            if self._entries.get(filename) is not entry:
+                return False
+            self._entries.move_to_end(filename)
+            return True
+
+    def put(self, filename: str, path: str, data_frame, metadata: dict, checksum: str = None) -> None:
+        # data_frame can be None, it is loaded on first access then
+        identity = FileIdentity.from_path(path)
+        identity.checksum = checksum or file_checksum(path)
+        with self._lock:
+            self._entries[filename] = CacheEntry(identity, data_frame, metadata)
+            self._entries.move_to_end(filename)
+            self._unload_least_recently_used()
+
+    def load(self, filenames: list) -> dict:
+        with self._lock:
+            missing = {f: self._entries[f] for f in filenames if f in self._entries and self._entries[f].data_frame is None}
+            # only the files being loaded are locked, loaded data frames and other files are not blocked by a load
+            locks = [self._load_locks.setdefault(f, threading.Lock()) for f in sorted(missing)]
+        if missing:
+            for lock in locks: # always locked in the same order, so concurrent loads can not deadlock
+                lock.acquire()
+            try:
+                with self._lock: # loaded by another thread in the meantime
+                    missing = {f: entry for f, entry in missing.items() if self._entries.get(f) is entry and entry.data_frame is None}
+                if missing:
+                    loaded = self.loader(missing)
+                    with self._lock:
+                        for filename, data_frame in loaded.items():
+                            if self._entries.get(filename) is missing[filename]: # not replaced in the meantime
+                                self._entries[filename].data_frame = data_frame
+            finally:
+                for lock in locks:
+                    lock.release()
+
+        with self._lock:
+            data_frames = {}
+            for filename in filenames:
+                entry = self._entries.get(filename)
+                if entry is not None and entry.data_frame is not None:
+                    data_frames[filename] = entry.data_frame
+                    self._entries.move_to_end(filename)
+            self._unload_least_recently_used(keep=data_frames.keys())
+            return data_frames
+
+    def _unload_least_recently_used(self, keep=()) -> None:
+        loaded = [f for f, entry in self._entries.items() if entry.data_frame is not None]
+        for filename in loaded[:max(len(loaded) - self.max_entries, 0)]:
+            if filename not in keep:
+                self._entries[filename].data_frame = None
+                print(f"Unloaded {filename} from data cache.")
+
+    def evict(self, filename: str) -> None:
+        with self._lock:
+            self._entries.pop(filename, None)
+            self._load_locks.pop(filename, None)
+
+    def retain(self, filenames: list) -> None:
+        # drop entries of files that are no longer available
+        with self._lock:
+            for filename in list(self._entries.keys()):
+                if filename not in filenames:
+                    del self._entries[filename]
+                    self._load_locks.pop(filename, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._load_locks.clear()
+            self._derived.clear()
+
+    def metadata(self, filenames: list) -> dict:
+        with self._lock:
+            return {f: self._entries[f].metadata for f in filenames if f in self._entries}
+
+    def data_frames(self, filenames: list) -> LazyDataFrames:
+        with self._lock:
+            return LazyDataFrames(self, [f for f in filenames if f in self._entries])
+
+    '''
+    Get a structure derived from the metadata and data frames returned by get_data, build(files, metadata, data_frames)
+    is only called if these files or their content changed since the structure was built.
+    '''
+    def derived(self, name: str, build, metadata: dict, data_frames: LazyDataFrames):
+        files = list(metadata.keys())
+        with self._lock:
+            versions = tuple((f, self._entries[f].identity.checksum if f in self._entries else None) for f in files)
+            cached = self._derived.get(name)
+            if cached is not None and cached[0] == versions:
+                return cached[1]
+
+        value = build(files, metadata, data_frames)
+        with self._lock:
+            self._derived[name] = (versions, value)
+        return value
+
+
+data_cache = DataCache(int(os.getenv("DATA_CACHE_MAX_ENTRIES", "64")))
@@ -1,10 +1,15 @@
 import os
-from excel_preparations import ExcelPreparations
+import asyncio
+import pandas as pd
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from excel_preparations import ExcelPreparations, is_supported_file
+from data_cache import data_cache, LazyDataFrames
+from checksums import file_checksum
+from sidecar_cache import sidecar_cache
+from metadata_store import metadata_store
 from utils import answer_to_json
-import json
-from datetime import datetime
-import re
-import hashlib
+from llm_cache import discard_answer
 
 
 class ColumnType():
@@ -30,142 +35,396 @@ class MetadataType():
 all_columns = [attr for attr in dir(ColumnType) if not callable(getattr(ColumnType, attr)) and not attr.startswith("__")]
 
 
+# files that are ingested in the background (see ingestion_queue.py), get_data skips them until they are ready
+pending_files = set()
+
 def list_files_in_tmp():
     tmp_dir = os.path.join(os.getcwd(), 'tmp')
     if not os.path.exists(tmp_dir):
         return []
 
     files = os.listdir(tmp_dir)
-    files = list(filter(lambda x: x.endswith('.xlsx'), files))
+    files = list(filter(is_supported_file, files))
     return files
 
-def load_metadata_cache():
-    metadata = {}
-    cache_files = os.listdir('tmp')
-    for filename in cache_files:
-        if filename.endswith('.json') and not filename.startswith("file_mapping"):
-            parts = filename.split('_', 1)
-            if len(parts) != 2 or not re.match('^\d{4}-\d{2}-\d{2}$', parts[0]):
-                print(f"Invalid cache file: {filename}")
-                continue
-            date = parts[0]
-            filename = parts[1]
-            if date != datetime.now().strftime("%Y-%m-%d"):
-                os.remove(f'tmp/{date}_{filename}')
-                xlsx_filename = filename.replace(".json", "")
-                os.remove(f'tmp/{xlsx_filename}')
-                continue
-            with open(f'tmp/{date}_{filename}', 'r') as f:
-                metadata[filename.split(".json")[0]] = json.load(f)
-    return metadata
-
-def extract_metadata(model, filenames: list, data_frames: dict, info_texts: dict) -> dict:
-    metadata_prompt = """As an AI assistant, please extract the metadata from this filename: '{filename}' and this information: '{info_text}'. Also map the columns to a list of available options.
+metadata_prompt = """As an AI assistant, please extract the metadata from this filename: '{filename}' and this information: '{info_text}'. Also map the columns to a list of available options.
      
-        ----------------------------------------
-        The columns are:
-        {columns}.
-        Available options are: {all_columns}.
-        ----------------------------------------
-        
-        The output should be in the following format:
-        """
-
-    prompt_end = """
-        {
-            "type": "type of the data. Available options are: sales, inventory, costs_per_unit.",
-            "country_code": "country code. Available options are: CH, DE, FR, US, ES, global.",
-            "year_from": "The year the data starts from.",
-            "year_to": "year_to", If the data is for a single year, year_from and year_to should be the same.
-            "columns": "Map columns to available options. Example: {'Cost per Unit ($)': 'cost_per_unit_dollar', 'Lead Time (Days)': 'lead_time_days', ...}"
-        }
-
-        Remember to only give the json object as output, without any additional text. Strictly avoid anything else than JSON output also exaplanations and other text."""
-
-    curr_date = datetime.now().strftime("%Y-%m-%d")
-    cached_metadata = load_metadata_cache()
-    metadata = {}
-    for filename in filenames:
-        if not filename.endswith('.xlsx'):
-            continue
-        df_columns = data_frames[filename].columns.to_list()
-        info_text = info_texts[filename]
+    ----------------------------------------
+    The columns are:
+    {columns}.
+    Available options are: {all_columns}.
+    ----------------------------------------
+    
+    The output should be in the following format:
+    """
+
+metadata_prompt_end = """
+    {
+        "type": "type of the data. Available options are: sales, inventory, costs_per_unit.",
+        "country_code": "country code. Available options are: CH, DE, FR, US, ES, global.",
+        "year_from": "The year the data starts from.",
+        "year_to": "year_to", If the data is for a single year, year_from and year_to should be the same.
+        "columns": "Map columns to available options. Example: {'Cost per Unit ($)': 'cost_per_unit_dollar', 'Lead Time (Days)': 'lead_time_days', ...}"
+    }
+
+    Remember to only give the json object as output, without any additional text. Strictly avoid anything else than JSON output also exaplanations and other text."""
+
+batch_metadata_prompt = """As an AI assistant, please extract the metadata of each of the following files from its filename and information. Also map the columns of each file to a list of available options.
 
-        if filename in cached_metadata:
-            if cached_metadata[filename]["checksum"] == hashlib.md5(open(f'tmp/{filename}','rb').read()).hexdigest():
-                metadata[filename] = cached_metadata[filename]
-                continue
-            else:
-                print(f"Provided file {filename} is different than cached one.")
+    Available options are: {all_columns}.
+    ----------------------------------------
+    {files}
+    ----------------------------------------
 
-        prompt = (
+    The output should be one json object with the filenames as keys and the metadata of the file as value. The metadata of each file should be in the following format:
+    """
+
+batch_file_prompt = """Filename: '{filename}'
+    Information: '{info_text}'
+    Columns: {columns}.
+    """
+
+# number of metadata requests sent to the LLM at the same time
+METADATA_MAX_CONCURRENCY = int(os.getenv("METADATA_MAX_CONCURRENCY", "4"))
+# number of files described in one metadata request, 1 sends one request per file
+METADATA_BATCH_SIZE = max(int(os.getenv("METADATA_BATCH_SIZE", "1")), 1)
+
+
+def parse_metadata_answer(answer_dict: dict) -> dict:
+    answer_dict["columns"] = {str(v).lower(): k for k, v in answer_dict["columns"].items()} # swap keys and values
+    if isinstance(answer_dict["year_from"], str) and answer_dict["year_from"].isdigit(): # year can be "unknown"
+        answer_dict["year_from"] = int(answer_dict["year_from"])
+    if isinstance(answer_dict["year_to"], str) and answer_dict["year_to"].isdigit():
+        answer_dict["year_to"] = int(answer_dict["year_to"])
+    return answer_dict
+
+def metadata_request_prompt(filenames: list, data_frames: dict, info_texts: dict) -> str:
+    if len(filenames) == 1:
+        filename = filenames[0]
+        return (
             metadata_prompt.format(
-                filename=filename, columns=", ".join(df_columns),
-                info_text=info_text,
+                filename=filename, columns=", ".join(data_frames[filename].columns.to_list()),
+                info_text=info_texts[filename],
                 all_columns=", ".join(all_columns)
             )
-            + prompt_end
+            + metadata_prompt_end
+        )
+    files = "\n    ".join(
+        batch_file_prompt.format(
+            filename=filename, columns=", ".join(data_frames[filename].columns.to_list()),
+            info_text=info_texts[filename]
         )
-        answer = ""
-        for x in model([{"role": "user", "content": prompt}]):
-            answer += x
+        for filename in filenames
+    )
+    return batch_metadata_prompt.format(files=files, all_columns=", ".join(all_columns)) + metadata_prompt_end
 
-        answer_dict = answer_to_json(answer)
-        answer_dict["columns"] = {str(v).lower(): k for k, v in answer_dict["columns"].items()} # swap keys and values
-        if isinstance(answer_dict["year_from"], str) and answer_dict["year_from"].isdigit(): # year can be "unknown"
-            answer_dict["year_from"] = int(answer_dict["year_from"])
-        if isinstance(answer_dict["year_to"], str) and answer_dict["year_to"].isdigit():
-            answer_dict["year_to"] = int(answer_dict["year_to"])
+def split_metadata_answer(model, history: list, answer: str, filenames: list) -> (dict, list):
+    # invalid or incomplete answers are discarded from the LLM cache, otherwise they would be returned again
+    try:
+        metadata, missing = parse_metadata_answers(answer, filenames)
+    except Exception:
+        discard_answer(model, history)
+        raise
+    if missing:
+        discard_answer(model, history)
+    return metadata, missing
 
+def parse_metadata_answers(answer: str, filenames: list) -> (dict, list):
+    # returns the metadata per file and the files missing in a batched answer
+    answer_dict = answer_to_json(answer)
+    if len(filenames) == 1:
+        return {filenames[0]: parse_metadata_answer(answer_dict)}, []
 
-        metadata[filename] = answer_dict
+    metadata = {}
+    missing = []
+    for filename in filenames:
+        try:
+            metadata[filename] = parse_metadata_answer(answer_dict[filename])
+        except Exception as e:
+            print(f"No valid metadata for {filename} in batched answer ({e}), requesting it separately.")
+            missing.append(filename)
+    return metadata, missing
+
+'''
+Ask the LLM for the metadata of one or several files (in one prompt), returns the metadata per file
+'''
+def request_metadata(model, filenames: list, data_frames: dict, info_texts: dict) -> dict:
+    history = [{"role": "user", "content": metadata_request_prompt(filenames, data_frames, info_texts)}]
+    answer = model.complete(history)
+    metadata, missing = split_metadata_answer(model, history, answer, filenames)
+
+    # files missing in a batched answer are requested one by one
+    for filename in missing:
+        metadata.update(request_metadata(model, [filename], data_frames, info_texts))
+    return metadata
 
-        answer_dict["checksum"] = hashlib.md5(open(f'tmp/{filename}','rb').read()).hexdigest()
-        with open(f"tmp/{curr_date}_{filename}.json", "w") as f:
-            json.dump(answer_dict, f)
+async def request_metadata_async(model, filenames: list, data_frames: dict, info_texts: dict) -> dict:
+    history = [{"role": "user", "content": metadata_request_prompt(filenames, data_frames, info_texts)}]
+    answer = await model.complete(history)
+    metadata, missing = split_metadata_answer(model, history, answer, filenames)
 
+    answers = await asyncio.gather(*[request_metadata_async(model, [filename], data_frames, info_texts) for filename in missing])
+    for answer in answers:
+        metadata.update(answer)
     return metadata
 
+'''
+Metadata of the files that is stored already or can be classified locally, and the checksums of the files the LLM has to describe
+'''
+def known_metadata(filenames: list, data_frames: dict, info_texts: dict) -> (dict, dict):
+    from metadata_classifier import classify_metadata, CLASSIFIER_THRESHOLD # depends on ColumnType
+
+    metadata = {}
+    checksums = {}
+    for filename in filenames:
+        if not is_supported_file(filename):
+            continue
+
+        checksum = file_checksum(f'tmp/{filename}')
+        cached_metadata = metadata_store.get(checksum, filename)
+        if cached_metadata is not None:
+            metadata[filename] = cached_metadata
+            continue
+
+        # files following the known naming and header conventions do not need the LLM
+        classified_metadata, confidence = classify_metadata(filename, data_frames[filename], info_texts[filename])
+        if confidence >= CLASSIFIER_THRESHOLD:
+            classified_metadata["checksum"] = checksum
+            metadata_store.put(checksum, filename, classified_metadata)
+            metadata[filename] = classified_metadata
+            continue
+        print(f"Metadata of {filename} could not be classified locally (confidence {confidence:.2f}), asking the LLM.")
+        checksums[filename] = checksum
+    return metadata, checksums
+
+def store_metadata_answer(answer: dict, checksums: dict, metadata: dict) -> None:
+    for filename, answer_dict in answer.items():
+        answer_dict["checksum"] = checksums[filename]
+        metadata_store.put(checksums[filename], filename, answer_dict)
+        metadata[filename] = answer_dict
+
+def metadata_batches(checksums: dict) -> list:
+    pending = list(checksums.keys())
+    return [pending[i:i + METADATA_BATCH_SIZE] for i in range(0, len(pending), METADATA_BATCH_SIZE)]
+
+def failed_metadata_batch(batch: list, error: Exception) -> dict:
+    # a failed request only leaves the files of its own batch without metadata, they are requested again later
+    print(f"Metadata request for {', '.join(batch)} failed: {error}")
+    return {}
+
+'''
+Metadata of the files: stored, classified locally or requested from the LLM. Files whose request failed are missing in the result.
+'''
+def extract_metadata(model, filenames: list, data_frames: dict, info_texts: dict) -> dict:
+    metadata, checksums = known_metadata(filenames, data_frames, info_texts)
+
+    def request(batch):
+        try:
+            return request_metadata(model, batch, data_frames, info_texts)
+        except Exception as e:
+            return failed_metadata_batch(batch, e)
+
+    # request the metadata of all remaining files concurrently instead of one after another
+    batches = metadata_batches(checksums)
+    if batches:
+        with ThreadPoolExecutor(max_workers=min(METADATA_MAX_CONCURRENCY, len(batches))) as executor:
+            for answer in executor.map(request, batches):
+                store_metadata_answer(answer, checksums, metadata)
+
+    return {f: metadata[f] for f in filenames if f in metadata}
+
+'''
+extract_metadata for async models (see async_llm_factory), the requests are awaited instead of blocking a thread each
+'''
+async def extract_metadata_async(model, filenames: list, data_frames: dict, info_texts: dict) -> dict:
+    metadata, checksums = known_metadata(filenames, data_frames, info_texts)
+
+    semaphore = asyncio.Semaphore(METADATA_MAX_CONCURRENCY)
+    async def request(batch):
+        async with semaphore:
+            try:
+                return await request_metadata_async(model, batch, data_frames, info_texts)
+            except Exception as e:
+                return failed_metadata_batch(batch, e)
+
+    for answer in await asyncio.gather(*[request(batch) for batch in metadata_batches(checksums)]):
+        store_metadata_answer(answer, checksums, metadata)
+
+    return {f: metadata[f] for f in filenames if f in metadata}
+
 
 valid_months = ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December"]
+month_numbers = {month: idx + 1 for idx, month in enumerate(valid_months)}
+
+def month_number(value) -> float:
+    if isinstance(value, str):
+        if value in month_numbers:
+            return month_numbers[value]
+        value = pd.to_numeric(value, errors="coerce")
+    if isinstance(value, (int, float, np.number)) and not isinstance(value, bool) and value % 1 == 0 and 1 <= value <= 12:
+        return value
+    return np.nan
+
+def as_validated_integers(column: pd.Series, numbers: pd.Series, kind: str) -> pd.Series:
+    invalid = numbers.isna()
+    if not invalid.any():
+        return numbers.astype("int64")
+
+    # report invalid values once per column and keep them unchanged
+    values = column[invalid].unique().tolist()
+    print(f"Invalid {kind} in column '{column.name}' ({invalid.sum()} rows): {values[:10]}")
+    result = column.astype(object)
+    result[~invalid] = numbers[~invalid].astype("int64").astype(object)
+    return result
+
+'''
+Preprocess the month column to be an integer between 1 and 12.
+Every distinct value is mapped only once (month names to their number), invalid values are reported once per column.
 '''
-Preprocess the month column to be an integer between 1 and 12
-'''
-def preprocess_month_column(row: list) -> int:
-    if isinstance(row, str):
-        if row not in valid_months:
-            print(f"Invalid month (1): {row}")
-        idx = valid_months.index(row)
-        return idx + 1
-    elif isinstance(row, int):
-        if row < 1 or row > 12:
-            print(f"Invalid month (2): {row}")
-        return row
+def preprocess_month_column(column: pd.Series) -> pd.Series:
+    if pd.api.types.is_numeric_dtype(column):
+        numbers = column.where(column.between(1, 12) & (column % 1 == 0))
     else:
-        print(f"Invalid month (3): {row}")
-        return row
+        categorical = pd.Categorical(column)
+        category_numbers = np.array([month_number(c) for c in categorical.categories] + [np.nan], dtype="float64")
+        numbers = pd.Series(category_numbers[categorical.codes], index=column.index) # code -1 (missing) takes the last entry
+    return as_validated_integers(column, numbers, "months")
+
+'''
+Preprocess the year column to be an integer, invalid values are reported once per column.
+'''
+def preprocess_year_column(column: pd.Series) -> pd.Series:
+    numbers = pd.to_numeric(column, errors="coerce")
+    return as_validated_integers(column, numbers.where(numbers % 1 == 0), "years")
+
+# string columns with at most this ratio of distinct values are stored as categoricals
+CATEGORY_MAX_RATIO = 0.5
+
+'''
+Store a data frame in the most compact dtypes without losing information:
+low-cardinality string columns become categoricals, integers and floats are downcast where the values are unchanged.
+'''
+def optimize_dtypes(df: pd.DataFrame, name: str = "") -> pd.DataFrame:
+    memory_before = df.memory_usage(deep=True).sum()
+    for col in df.columns:
+        column = df[col]
+        if pd.api.types.is_bool_dtype(column):
+            continue
+        elif pd.api.types.is_integer_dtype(column):
+            df[col] = pd.to_numeric(column, downcast="integer")
+        elif pd.api.types.is_float_dtype(column):
+            downcast = column.astype("float32")
+            if ((downcast == column) | column.isna()).all(): # only if no precision is lost
+                df[col] = downcast
+        elif pd.api.types.infer_dtype(column, skipna=True) == "string" and len(column) > 0:
+            if column.nunique() <= CATEGORY_MAX_RATIO * len(column):
+                df[col] = column.astype("category")
+    memory_after = df.memory_usage(deep=True).sum()
+    print(f"Memory of {name}: {memory_before / 1024:.1f} KiB -> {memory_after / 1024:.1f} KiB")
+    return df
+
+'''
+Case-insensitive comparison of a column with a value.
+For categoricals only the (few) categories are lowercased, the rows are matched by their category codes.
+'''
+def lowercase_equals(column: pd.Series, value: str) -> pd.Series:
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        categories = column.cat.categories
+        matching_codes = np.flatnonzero(categories.astype(str).str.lower() == str(value).lower())
+        return pd.Series(np.isin(column.cat.codes, matching_codes), index=column.index)
+    return column.str.lower() == str(value).lower()
+
+def lowercase_categories(column: pd.Series) -> pd.Categorical:
+    # lowercase only the distinct values instead of every row
+    column = column if isinstance(column.dtype, pd.CategoricalDtype) else column.astype("category")
+    categories = column.cat.categories.astype(str).str.lower()
+    return pd.Categorical(categories.take(column.cat.codes.to_numpy(), allow_fill=True, fill_value=np.nan))
 
 column_preprocessing = {
     "month": preprocess_month_column,
-    "year": lambda x: int(x)
+    "year": preprocess_year_column,
 }
+def preprocess_columns(df: pd.DataFrame, columns: dict) -> pd.DataFrame:
+    for (col, df_col) in columns.items():
+        if col in column_preprocessing:
+            df[df_col] = column_preprocessing[col](df[df_col])
+    return df
+
 def preprocess_dataframes(data_frames: dict, metadata: dict) -> dict:
     for filename, df in data_frames.items():
         md = metadata[filename]
-        columns = md["columns"]
-        for (col, df_col) in columns.items():
-            if col in column_preprocessing:
-                df[df_col] = df[df_col].apply(column_preprocessing[col])
+        df = preprocess_columns(df, md["columns"])
+        data_frames[filename] = optimize_dtypes(df, filename)
     return data_frames
 
 
 '''
-Get all relevant data for a function call
+Parse files (in parallel) and preprocess them with their metadata, the preprocessed data frames are stored in the sidecar cache
 '''
-def get_data(model) -> (list, dict):
-    files = list_files_in_tmp()
+def parse_data_frames(metadata: dict) -> dict:
+    if not metadata:
+        return {}
     excel_preparation = ExcelPreparations()
-    data_frames, info_texts = excel_preparation.read_excel(files)
-    metadata = extract_metadata(model, files, data_frames, info_texts)
-    data_frames = preprocess_dataframes(data_frames, metadata)
-    return files, metadata, data_frames
\ No newline at end of file
+    parsed_data_frames, _ = excel_preparation.read_excel(list(metadata.keys()))
+    parsed_data_frames = preprocess_dataframes(parsed_data_frames, {f: metadata[f] for f in parsed_data_frames})
+    for filename, df in parsed_data_frames.items():
+        md = metadata[filename]
+        if sidecar_cache.save(md["checksum"], "preprocessed", df, {"columns": md["columns"]}):
+            sidecar_cache.delete(md["checksum"], "parsed") # only needed again if the metadata changes
+    return parsed_data_frames
+
+'''
+Load the data frames of cached files: preprocessed data frames are taken from the sidecar cache,
+all other files are parsed and preprocessed with their cached metadata.
+'''
+def load_data_frames(entries: dict) -> dict:
+    data_frames = {}
+    files_to_parse = {}
+    for filename, entry in entries.items():
+        df, info = sidecar_cache.load(entry.identity.checksum, "preprocessed")
+        if df is not None and info.get("columns") == entry.metadata["columns"]:
+            data_frames[filename] = df
+        else:
+            files_to_parse[filename] = entry.metadata
+    data_frames.update(parse_data_frames(files_to_parse))
+    return data_frames
+
+'''
+Write the preprocessed sidecar of a file without keeping its data frame, loading the file later only reads the sidecar
+'''
+def warm_sidecar(filename: str, metadata: dict) -> None:
+    if sidecar_cache.enabled and not sidecar_cache.exists(metadata["checksum"], "preprocessed"):
+        parse_data_frames({filename: metadata})
+
+data_cache.loader = load_data_frames
+
+'''
+Get the files in tmp/ with their metadata and data frames.
+Only the metadata is extracted here (from the header of new files), the data frames are loaded
+when a function accesses them for the first time. Files that are still ingested in the background are skipped.
+'''
+def get_data(model) -> (list, dict, LazyDataFrames):
+    files = list_files_in_tmp()
+    data_cache.retain(files)
+    files = [f for f in files if f not in pending_files]
+
+    stale_files = [f for f in files if not data_cache.is_fresh(f, os.path.join(os.getcwd(), 'tmp', f))]
+    new_files = []
+    for filename in stale_files:
+        file_path = os.path.join(os.getcwd(), 'tmp', filename)
+        checksum = file_checksum(file_path)
+        md = metadata_store.get(checksum, filename)
+        if md is not None:
+            data_cache.put(filename, file_path, None, md, checksum=checksum)
+        else:
+            new_files.append(filename)
+
+    if new_files:
+        excel_preparation = ExcelPreparations()
+        headers, info_texts = excel_preparation.read_headers(new_files)
+        metadata = extract_metadata(model, [f for f in new_files if f in headers], headers, info_texts)
+        for filename, md in metadata.items():
+            data_cache.put(filename, os.path.join(os.getcwd(), 'tmp', filename), None, md, checksum=md["checksum"])
+
+    files = [f for f in files if f in data_cache]
+    return files, data_cache.metadata(files), data_cache.data_frames(files)
@@ -1,71 +1,420 @@
-import pandas as pd
-from typing import List, Optional
-import os
-
-class ExcelPreparations:
-    def read_excel(self, files):
-        data_frames = {}
-        info_texts = {}
-        for file in files:
-            file_path = os.path.join(os.getcwd(), 'tmp', file)
-            if not os.path.exists(file_path) or not file_path.endswith(".xlsx"):
-                continue
-            [header_row, header_col] = self.detect_header_index(file_path)
-
-            # Extract header texts
-            if header_row > 0:
-                full_df = pd.read_excel(file_path)
-                info_texts[file] = ", ".join(filter(lambda x: "Unnamed" not in x, full_df.columns))
-                if header_row > 1:
-                    for i in range(0, header_row - 1):
-                        row = full_df.iloc[i, :]
-                        info_texts[file] += ". " + ", ".join(row[row.notna()].tolist())
-            else:
-                info_texts[file] = "No information"
-            
-            df = pd.read_excel(file_path, header=header_row)
-            df.columns = df.columns.str.strip() # remove leading and trailing whitespaces
-            df.columns = df.columns.str.replace("Unnamed.*", "Material", regex=True)
-            if header_col > 0:
-                df = df.drop(df.columns[:header_col], axis=1)
-            data_frames[file] = df
-        return data_frames, info_texts
-
-    def detect_header_index(self, file) -> Optional[List[int]]: # returns [header_row, header_col] with df index
-        df = pd.read_excel(file, header=None)
-        if df is None:
-            raise ValueError("File not loaded. Please load the file first using read_excel.")
-        
-        header_row = None
-        header_col = 0
-
-        # Detect the header row
-        for i in range(min(10, len(df))):  # Look at the first 10 rows only
-            row = df.iloc[i]
-            filled_cells = row.notna().sum()
-
-            # Check if the row has more than one filled cell
-            if filled_cells > 1:
-                # Check if the next row has the same number of filled cells
-                if i + 1 < len(df) and df.iloc[i + 1].notna().sum() == filled_cells:
-                    # Optionally, check if values are mostly strings, indicating headers
-                    if row.apply(lambda x: isinstance(x, str)).sum() > (0.5 * filled_cells):
-                        header_row = i
-                        break
-
-        # If both row and column are detected, return the header cell position
-        if header_row is not None:
-            return [header_row, header_col]
-
-        # Fallback: Check the first row and column with multiple filled cells if no header is identified
-        if header_row is None:
-            for i in range(len(df)):
-                if df.iloc[i].notna().sum() > 1:
-                    header_row = i
-                    break
-
-        # Return the position if either header row or column was detected, otherwise None
-        if header_row is not None:
-            return [header_row, header_col]
-        else:
-            return None # No header row or column detected
+import pandas as pd
+from pandas.errors import EmptyDataError
+from pandas.io.parsers import TextParser
+from typing import List, Optional
+import numpy as np
+import os
+import re
+import csv
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from checksums import file_checksum
+from sidecar_cache import sidecar_cache
+from reader_engines import EXCEL_READER_ENGINE, has_reader_engine, select_engine
+
+HEADER_SCAN_ROWS = 10 # the header is searched in the first rows only
+STREAMING_CHUNK_ROWS = int(os.getenv("STREAMING_CHUNK_ROWS", "50000")) # rows per chunk when streaming large files
+SUPPORTED_EXTENSIONS = (".xlsx", ".xls", ".csv", ".parquet")
+
+
+def file_format(file_path: str) -> str:
+    return os.path.splitext(file_path)[1].lower()
+
+def is_supported_file(file_path: str) -> bool:
+    # legacy .xls files need python-calamine or xlrd, without them they are skipped
+    return file_format(file_path) in SUPPORTED_EXTENSIONS and (file_format(file_path) != ".xls" or has_reader_engine(file_path))
+
+def csv_delimiter(file_path: str) -> str:
+    with open(file_path, newline="", encoding="utf-8-sig") as f:
+        sample = f.read(64 * 1024)
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=",;\t|").delimiter
+    except csv.Error:
+        return ","
+
+NUMBER_PATTERN = re.compile(r"^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$")
+
+def convert_csv_cell(value: str):
+    # numbers are converted like the numeric cells of a workbook
+    if not NUMBER_PATTERN.match(value):
+        return value
+    number = float(value)
+    return int(number) if number.is_integer() else number
+
+'''
+Read a file as it is (without header detection), e.g. to show it to the LLM
+'''
+def read_table_file(file_path: str) -> pd.DataFrame:
+    if file_format(file_path) == ".parquet":
+        return pd.read_parquet(file_path)
+    elif file_format(file_path) == ".csv":
+        return pd.read_csv(file_path, sep=csv_delimiter(file_path), encoding="utf-8-sig")
+    return pd.read_excel(file_path, engine=select_engine(file_path).name) # the engine names match the pandas engines
+
+'''
+Write a data frame in the format of the file it was read from and return the path of the written file.
+Legacy .xls files can not be written, they are written as .xlsx next to the original file.
+'''
+def write_table_file(df: pd.DataFrame, file_path: str, sheet_name: str) -> str:
+    if file_format(file_path) == ".parquet":
+        df.to_parquet(file_path, index=False)
+    elif file_format(file_path) == ".csv":
+        df.to_csv(file_path, index=False)
+    else:
+        if file_format(file_path) == ".xls":
+            file_path = os.path.splitext(file_path)[0] + ".xlsx"
+        writer = pd.ExcelWriter(file_path, engine="xlsxwriter")
+        df.to_excel(writer, sheet_name=sheet_name, index=False)
+        writer.close()
+    return file_path
+
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+'''
+Long-lived pool of the processes parsing workbooks in parallel, started on first use and shared by all ExcelPreparations.
+The workers are started by a fork server (spawned where there is none) instead of forking this process, forking a process
+with running threads (gui, ingestion, torch and FAISS) can deadlock the child. The workers start with this module imported
+and import the main module once, like with every start method other than fork, so scripts need a __main__ guard.
+'''
+def parse_pool(max_workers: int) -> ProcessPoolExecutor:
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            context = multiprocessing.get_context(start_method)
+            if start_method == "forkserver":
+                context.set_forkserver_preload([__name__])
+            _parse_pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+        return _parse_pool
+
+def discard_parse_pool(pool: ProcessPoolExecutor) -> None:
+    # a pool is broken once one of its workers died (e.g. out of memory), the next call starts a new one
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is pool:
+            _parse_pool = None
+    pool.shutdown(wait=False)
+
+def parse_file_in_worker(file_path: str, checksum: Optional[str], engine: str) -> (pd.DataFrame, str):
+    return ExcelPreparations(engine=engine).parse_file(file_path, checksum)
+
+
+class ExcelPreparations:
+    def __init__(self, use_sidecar: bool = True, max_workers: Optional[int] = None, engine: str = EXCEL_READER_ENGINE):
+        self.use_sidecar = use_sidecar # reuse data frames parsed before, see sidecar_cache.py
+        self.engine = engine # reader engine of workbooks, "auto" uses the fastest installed engine, see reader_engines.py
+        # number of processes parsing workbooks in parallel, parsing is CPU-bound and does not scale with threads
+        self.max_workers = max_workers or int(os.getenv("EXCEL_READ_WORKERS", os.cpu_count() or 1))
+
+    def read_excel(self, files):
+        data_frames = {}
+        info_texts = {}
+        files_to_parse = {}
+        for file in files:
+            file_path = os.path.join(os.getcwd(), 'tmp', file)
+            if not os.path.exists(file_path) or not is_supported_file(file_path):
+                continue
+            checksum = file_checksum(file_path) if self.use_sidecar else None
+            df, info = sidecar_cache.load(checksum, "parsed")
+            if df is not None:
+                data_frames[file], info_texts[file] = df, info["info_text"]
+            else:
+                files_to_parse[file] = (file_path, checksum)
+
+        results = None
+        if min(self.max_workers, len(files_to_parse)) > 1:
+            pool = parse_pool(self.max_workers)
+            try:
+                results = list(pool.map(
+                    parse_file_in_worker, *zip(*files_to_parse.values()), [self.engine] * len(files_to_parse)
+                ))
+            except BrokenProcessPool as e:
+                print(f"Parsing in worker processes failed, parsing the files in this process: {e}")
+                discard_parse_pool(pool)
+        if results is None:
+            results = [self.parse_file(file_path, checksum) for file_path, checksum in files_to_parse.values()]
+
+        for file, (df, info_text) in zip(files_to_parse, results):
+            data_frames[file], info_texts[file] = df, info_text
+        return {f: data_frames[f] for f in files if f in data_frames}, {f: info_texts[f] for f in files if f in info_texts}
+
+    def read_file(self, file_path: str) -> (pd.DataFrame, str):
+        checksum = file_checksum(file_path) if self.use_sidecar else None
+        df, info = sidecar_cache.load(checksum, "parsed")
+        if df is not None:
+            return df, info["info_text"]
+        return self.parse_file(file_path, checksum)
+
+    def parse_file(self, file_path: str, checksum: Optional[str] = None) -> (pd.DataFrame, str):
+        if file_format(file_path) == ".parquet":
+            df, info_text = self.read_parquet(file_path), "No information"
+        elif file_format(file_path) == ".csv":
+            df, info_text = self.parse_csv(file_path)
+        else:
+            # Parse the workbook once, header detection, info texts and the data frame all work on the same grid
+            grid = self.read_sheet_grid(file_path)
+            [header_row, header_col] = self.detect_header_index(grid)
+
+            info_text = self.extract_info_text(grid, header_row)
+            df = self.clean_columns(self.parse_grid(grid, header=header_row), header_col)
+
+        sidecar_cache.save(checksum, "parsed", df, {"info_text": info_text})
+        return df, info_text
+
+    '''
+    Parquet files have no rows above the header, the columns are read zero-copy from the memory-mapped file where possible
+    '''
+    def read_parquet(self, file_path: str) -> pd.DataFrame:
+        from pyarrow import parquet
+        df = parquet.read_table(file_path, memory_map=True).to_pandas()
+        return self.clean_columns(df, 0)
+
+    '''
+    The header of a CSV file is detected in its first rows like in a workbook, the rows below are read with the pyarrow CSV reader.
+    Files pyarrow can not read (e.g. rows with more cells than the header) are parsed like a workbook.
+    '''
+    def parse_csv(self, file_path: str) -> (pd.DataFrame, str):
+        grid = self.read_sheet_grid(file_path, max_rows=HEADER_SCAN_ROWS + 1)
+        header_index = self.detect_header_index(grid)
+        if header_index is None:
+            grid = self.read_sheet_grid(file_path)
+            header_index = self.detect_header_index(grid, max_rows=None)
+        [header_row, header_col] = header_index
+
+        info_text = self.extract_info_text(grid, header_row)
+        columns = self.parse_grid(grid[:header_row + 1], header=header_row).columns
+        try:
+            from pyarrow import csv as arrow_csv
+            table = arrow_csv.read_csv(
+                file_path,
+                read_options=arrow_csv.ReadOptions(skip_rows=header_row + 1, column_names=list(columns)),
+                parse_options=arrow_csv.ParseOptions(delimiter=csv_delimiter(file_path)),
+                convert_options=arrow_csv.ConvertOptions(strings_can_be_null=True),
+            )
+            df = table.to_pandas()
+            filled_rows = np.flatnonzero(df.notna().any(axis=1).to_numpy())
+            df = df.iloc[: filled_rows[-1] + 1 if len(filled_rows) else 0] # trim trailing empty rows like in a workbook
+            for column in df.select_dtypes(include="float").columns:
+                # integral numbers are read as int like the numeric cells of a workbook
+                if df[column].notna().all() and (df[column] % 1 == 0).all():
+                    df[column] = df[column].astype("int64")
+        except Exception as e:
+            print(f"Could not read {file_path} with pyarrow, parsing it with pandas: {e}")
+            grid = self.read_sheet_grid(file_path)
+            df = self.parse_grid(grid, header=header_row)
+        return self.clean_columns(df, header_col), info_text
+
+    '''
+    Read only the header of a file: the columns (as a data frame without rows) and the info text above them.
+    Only the first rows are streamed from the file, unless no header can be found in them.
+    '''
+    def read_header(self, file_path: str) -> (pd.DataFrame, str):
+        if file_format(file_path) == ".parquet":
+            from pyarrow import parquet
+            return self.clean_columns(pd.DataFrame(columns=parquet.read_schema(file_path).names), 0), "No information"
+
+        grid = self.read_sheet_grid(file_path, max_rows=HEADER_SCAN_ROWS + 1)
+        header_index = self.detect_header_index(grid)
+        if header_index is None:
+            grid = self.read_sheet_grid(file_path)
+            header_index = self.detect_header_index(grid, max_rows=None)
+        [header_row, header_col] = header_index
+
+        info_text = self.extract_info_text(grid, header_row)
+        df = self.clean_columns(self.parse_grid(grid[:header_row + 1], header=header_row), header_col)
+        return df, info_text
+
+    def read_headers(self, files):
+        headers = {}
+        info_texts = {}
+        for file in files:
+            file_path = os.path.join(os.getcwd(), 'tmp', file)
+            if not os.path.exists(file_path) or not is_supported_file(file_path):
+                continue
+            headers[file], info_texts[file] = self.read_header(file_path)
+        return headers, info_texts
+
+    def extract_info_text(self, grid: list, header_row: int) -> str:
+        # Extract header texts
+        if header_row > 0:
+            full_df = self.parse_grid(grid[:header_row], header=0)
+            info_text = ", ".join(filter(lambda x: "Unnamed" not in x, full_df.columns))
+            if header_row > 1:
+                for i in range(0, header_row - 1):
+                    row = full_df.iloc[i, :]
+                    info_text += ". " + ", ".join(row[row.notna()].tolist())
+        else:
+            info_text = "No information"
+        return info_text
+
+    def clean_columns(self, df: pd.DataFrame, header_col: int) -> pd.DataFrame:
+        df.columns = df.columns.str.strip() # remove leading and trailing whitespaces
+        df.columns = df.columns.str.replace("Unnamed.*", "Material", regex=True)
+        if header_col > 0:
+            df = df.drop(df.columns[:header_col], axis=1)
+        return df
+
+    '''
+    Read the cells of the first sheet the same way pd.read_excel does with the selected reader engine,
+    so the grid can be parsed several times without opening the workbook again. CSV files are read into the same grid.
+    '''
+    def read_sheet_grid(self, file, max_rows: Optional[int] = None) -> list:
+        if isinstance(file, str) and file_format(file) == ".csv":
+            return self.read_csv_grid(file, max_rows)
+
+        rows = self.iter_sheet_rows(file)
+        grid = []
+        last_row_with_data = -1
+        try:
+            for row_number, converted_row in enumerate(rows):
+                while converted_row and converted_row[-1] == "": # trim trailing empty cells
+                    converted_row.pop()
+                if converted_row:
+                    last_row_with_data = row_number
+                grid.append(converted_row)
+                if max_rows is not None and len(grid) >= max_rows: # stop streaming, the remaining rows are not needed
+                    break
+        finally:
+            rows.close() # closes the workbook
+
+        grid = grid[: last_row_with_data + 1] # trim trailing empty rows
+        if grid:
+            max_width = max(len(row) for row in grid)
+            grid = [row + [""] * (max_width - len(row)) for row in grid]
+        return grid
+
+    def read_csv_grid(self, file_path: str, max_rows: Optional[int] = None) -> list:
+        grid = []
+        with open(file_path, newline="", encoding="utf-8-sig") as f:
+            for row in csv.reader(f, delimiter=csv_delimiter(file_path)):
+                converted_row = [convert_csv_cell(value) if value != "" else "" for value in row]
+                while converted_row and converted_row[-1] == "": # trim trailing empty cells
+                    converted_row.pop()
+                grid.append(converted_row)
+                if max_rows is not None and len(grid) >= max_rows:
+                    break
+
+        while grid and not grid[-1]: # trim trailing empty rows
+            grid.pop()
+        if grid:
+            max_width = max(len(row) for row in grid)
+            grid = [row + [""] * (max_width - len(row)) for row in grid]
+        return grid
+
+    '''
+    Stream the data rows of a file as data frames of chunk_size rows, so the sheet is never held in memory as a whole.
+    The header has to be in the first rows of the sheet.
+    '''
+    def read_chunks(self, file_path: str, chunk_size: int = STREAMING_CHUNK_ROWS):
+        if file_format(file_path) == ".parquet":
+            from pyarrow import parquet
+            for batch in parquet.ParquetFile(file_path, memory_map=True).iter_batches(batch_size=chunk_size):
+                yield self.clean_columns(batch.to_pandas(), 0)
+            return
+
+        prefix = self.read_sheet_grid(file_path, max_rows=HEADER_SCAN_ROWS + 1)
+        header_index = self.detect_header_index(prefix)
+        if header_index is None:
+            raise ValueError(f"No header found in the first {HEADER_SCAN_ROWS} rows of {file_path}.")
+        [header_row, header_col] = header_index
+        header = prefix[header_row]
+
+        if file_format(file_path) == ".csv":
+            columns = self.parse_grid(prefix[:header_row + 1], header=header_row).columns
+            for chunk in pd.read_csv(file_path, sep=csv_delimiter(file_path), skiprows=header_row + 1, header=None,
+                                     names=columns, chunksize=chunk_size, encoding="utf-8-sig"):
+                yield self.clean_columns(chunk, header_col)
+            return
+
+        sheet_rows = self.iter_sheet_rows(file_path)
+        try:
+            rows = []
+            for row_number, converted_row in enumerate(sheet_rows):
+                if row_number <= header_row:
+                    continue
+                converted_row = converted_row[:len(header)]
+                rows.append(converted_row + [""] * (len(header) - len(converted_row)))
+                if len(rows) >= chunk_size:
+                    yield self.clean_columns(self.parse_grid([header] + rows, header=0), header_col)
+                    rows = []
+            if rows:
+                yield self.clean_columns(self.parse_grid([header] + rows, header=0), header_col)
+        finally:
+            sheet_rows.close()
+
+    '''
+    Stream the converted rows of the first sheet of a workbook with the reader engine of this instance.
+    Opened files (e.g. uploads) have no extension and are read with openpyxl.
+    '''
+    def iter_sheet_rows(self, file):
+        if not isinstance(file, str):
+            return select_engine("workbook.xlsx", "openpyxl").iter_rows(file)
+        return select_engine(file, self.engine).iter_rows(file)
+
+    '''
+    Build a data frame from a sheet grid, equivalent to pd.read_excel(file, header=header)
+    '''
+    def parse_grid(self, grid: list, header: Optional[int] = 0) -> pd.DataFrame:
+        if not grid:
+            return pd.DataFrame()
+        try:
+            return TextParser(grid, header=header, skip_blank_lines=False).read()
+        except EmptyDataError:
+            return pd.DataFrame()
+
+    def detect_header_index(self, file, max_rows: Optional[int] = HEADER_SCAN_ROWS + 1) -> Optional[List[int]]: # returns [header_row, header_col] with df index
+        # file is either a path, a sheet grid or a data frame read with header=None.
+        # Unless max_rows is None, only the first rows are streamed from the file; the full sheet is
+        # read only if no header can be found in them.
+        if isinstance(file, pd.DataFrame):
+            df = file
+        else:
+            grid = file if isinstance(file, list) else None
+            if max_rows is not None:
+                prefix = grid[:max_rows] if grid is not None else self.read_sheet_grid(file, max_rows=max_rows)
+                header_index = self.detect_header_index(self.parse_grid(prefix, header=None))
+                if header_index is not None:
+                    return header_index
+            if grid is None:
+                grid = self.read_sheet_grid(file)
+            df = self.parse_grid(grid, header=None)
+        if df is None:
+            raise ValueError("File not loaded. Please load the file first using read_excel.")
+
+        header_row = None
+        header_col = 0
+
+        # Detect the header row
+        for i in range(min(HEADER_SCAN_ROWS, len(df))):  # Look at the first rows only
+            row = df.iloc[i]
+            filled_cells = row.notna().sum()
+
+            # Check if the row has more than one filled cell
+            if filled_cells > 1:
+                # Check if the next row has the same number of filled cells
+                if i + 1 < len(df) and df.iloc[i + 1].notna().sum() == filled_cells:
+                    # Optionally, check if values are mostly strings, indicating headers
+                    if row.apply(lambda x: isinstance(x, str)).sum() > (0.5 * filled_cells):
+                        header_row = i
+                        break
+
+        # If both row and column are detected, return the header cell position
+        if header_row is not None:
+            return [header_row, header_col]
+
+        # Fallback: Check the first row and column with multiple filled cells if no header is identified
+        if header_row is None:
+            for i in range(len(df)):
+                if df.iloc[i].notna().sum() > 1:
+                    header_row = i
+                    break
+
+        # Return the position if either header row or column was detected, otherwise None
+        if header_row is not None:
+            return [header_row, header_col]
+        else:
+            return None # No header row or column detected
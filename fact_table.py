@@ -0,0 +1,153 @@
+import os
+import numpy as np
+import pandas as pd
+from data_cache import data_cache, LazyDataFrames
+from data_loader import ColumnType, MetadataType, lowercase_categories, preprocess_columns
+from excel_preparations import ExcelPreparations
+from sidecar_cache import sidecar_cache
+from streaming_aggregation import GroupAggregator
+from utils import get_currency_conversion_rate
+
+'''
+Long-format fact table of all sales files, one row per sales record:
+file, country, year, month, material, units_sold, sales (original currency), currency.
+The columns are taken from the ColumnType mapping in the metadata, so questions across countries
+are answered by a single vectorized filter and groupby instead of one scan per file.
+Materials are lowercased once while building, the table is rebuilt only if the cached data changed.
+Files larger than STREAMING_THRESHOLD_MB are never loaded as a whole: they are streamed in chunks and
+contribute one row per year, month and material with the summed units and sales. These sums are stored in the
+sidecar cache by the checksum of the file, so a file is streamed only once and not again on every rebuild.
+'''
+FACT_COLUMNS = ["file", "country", "year", "month", "material", "units_sold", "sales", "currency"]
+
+SALES_CURRENCIES = {
+    ColumnType.TOTAL_SALES_DOLLAR: "USD",
+    ColumnType.TOTAL_SALES_EURO: "EUR",
+}
+
+STREAMING_THRESHOLD_MB = float(os.getenv("STREAMING_THRESHOLD_MB", "100"))
+
+
+def sales_column_and_currency(columns: dict) -> (str, str):
+    for column_type, code in SALES_CURRENCIES.items():
+        if column_type in columns:
+            return columns[column_type], code
+    return None, None
+
+def year_and_month(df: pd.DataFrame, mt: dict) -> (pd.Series, pd.Series):
+    columns = mt[MetadataType.COLUMNS]
+    if ColumnType.YEAR in columns:
+        year = pd.to_numeric(df[columns[ColumnType.YEAR]], errors="coerce")
+    else:
+        try:
+            year = int(mt[MetadataType.YEAR_FROM]) if int(mt[MetadataType.YEAR_FROM]) == int(mt[MetadataType.YEAR_TO]) else np.nan
+        except (TypeError, ValueError):
+            year = np.nan # "unknown"
+
+    month = pd.to_numeric(df[columns[ColumnType.MONTH]], errors="coerce") if ColumnType.MONTH in columns else np.nan
+    return year, month
+
+def file_facts(file: str, mt: dict, df: pd.DataFrame) -> pd.DataFrame:
+    columns = mt[MetadataType.COLUMNS]
+    sales_column, currency = sales_column_and_currency(columns)
+    year, month = year_and_month(df, mt)
+
+    return pd.DataFrame({
+        "file": file,
+        "country": mt[MetadataType.COUNTRY_CODE],
+        "year": year,
+        "month": month,
+        "material": lowercase_categories(df[columns[ColumnType.MATERIAL]]),
+        "units_sold": df[columns[ColumnType.UNITS_SOLD]].to_numpy(),
+        "sales": df[sales_column].to_numpy() if sales_column else np.nan,
+        "currency": currency,
+    }, index=df.index).reset_index(drop=True)
+
+def stream_sales_sums(file: str, mt: dict, file_path: str) -> pd.DataFrame:
+    columns = mt[MetadataType.COLUMNS]
+    sales_column, _ = sales_column_and_currency(columns)
+
+    aggregator = GroupAggregator(["year", "month", "material"], ["units_sold", "sales"])
+    for chunk in ExcelPreparations().read_chunks(file_path):
+        chunk = preprocess_columns(chunk, columns)
+        year, month = year_and_month(chunk, mt)
+        aggregator.update(pd.DataFrame({
+            "year": year,
+            "month": month,
+            "material": pd.Series(lowercase_categories(chunk[columns[ColumnType.MATERIAL]]), index=chunk.index).astype(object),
+            "units_sold": chunk[columns[ColumnType.UNITS_SOLD]],
+            "sales": chunk[sales_column] if sales_column else np.nan,
+        }, index=chunk.index))
+
+    sums = aggregator.result().reset_index()
+    print(f"Streamed {aggregator.rows} rows of {file} into {len(sums)} groups.")
+    return pd.DataFrame({
+        "year": sums["year"],
+        "month": sums["month"],
+        "material": sums["material"],
+        "units_sold": sums[("units_sold", "sum")],
+        "sales": sums[("sales", "sum")].where(sums[("sales", "count")] > 0), # no sales column
+    })
+
+def streamed_file_facts(file: str, mt: dict, file_path: str) -> pd.DataFrame:
+    columns = mt[MetadataType.COLUMNS]
+    _, currency = sales_column_and_currency(columns)
+
+    sums, info = sidecar_cache.load(mt.get("checksum"), "sales_sums")
+    if sums is None or info.get("columns") != columns:
+        sums = stream_sales_sums(file, mt, file_path)
+        sidecar_cache.save(mt.get("checksum"), "sales_sums", sums, {"columns": columns})
+    return pd.DataFrame({
+        "file": file,
+        "country": mt[MetadataType.COUNTRY_CODE],
+        "year": sums["year"],
+        "month": sums["month"],
+        "material": pd.Categorical(sums["material"]),
+        "units_sold": sums["units_sold"],
+        "sales": sums["sales"],
+        "currency": currency,
+    })
+
+def is_large_file(file: str) -> bool:
+    file_path = os.path.join(os.getcwd(), 'tmp', file)
+    return os.path.exists(file_path) and os.path.getsize(file_path) > STREAMING_THRESHOLD_MB * 1024 * 1024
+
+def build_sales_fact_table(files: list, metadata: dict, data_frames: LazyDataFrames) -> pd.DataFrame:
+    def is_sales_file(file):
+        columns = metadata[file][MetadataType.COLUMNS]
+        return ColumnType.MATERIAL in columns and ColumnType.UNITS_SOLD in columns
+
+    sales_files = list(filter(is_sales_file, files))
+    large_files = list(filter(is_large_file, sales_files))
+    data_frames.preload([f for f in sales_files if f not in large_files])
+
+    frames = []
+    for file in sales_files:
+        if file in large_files:
+            frames.append(streamed_file_facts(file, metadata[file], os.path.join(os.getcwd(), 'tmp', file)))
+        else:
+            frames.append(file_facts(file, metadata[file], data_frames[file]))
+
+    if not frames:
+        return pd.DataFrame(columns=FACT_COLUMNS)
+
+    facts = pd.concat(frames, ignore_index=True)
+    for column in ["file", "country", "currency", "material"]:
+        facts[column] = facts[column].astype("category")
+
+    print(f"Built sales fact table with {len(facts)} rows from {len(frames)} files.")
+    return facts[FACT_COLUMNS]
+
+'''
+Sales of fact rows converted to a currency, returns the converted sales and the conversion rate of every currency in the rows.
+The rates are only requested when sales are converted, one per currency instead of one per file.
+'''
+def sales_in_currency(facts: pd.DataFrame, to_currency: str) -> (pd.Series, dict):
+    rates = {currency: get_currency_conversion_rate(currency, to_currency) for currency in facts["currency"].dropna().unique()}
+    return facts["sales"] * facts["currency"].map(rates).astype(float), rates
+
+'''
+Get the fact table of the sales files among the files returned by get_data
+'''
+def get_sales_facts(metadata: dict, data_frames: LazyDataFrames) -> pd.DataFrame:
+    return data_cache.derived("sales_facts", build_sales_fact_table, metadata, data_frames)
@@ -1,4 +1,9 @@
-from llm_factory import llm_factory
+import os
+import asyncio
+import inspect
+import threading
+from llm_factory import llm_factory, backend, BlockingLLM
+from llm_cache import discard_answer
 from functions import (
     get_suppliers_by_material,
     get_suppliers_by_material_and_year,
@@ -17,12 +22,8 @@ from utils import answer_to_json
 import traceback
 from dotenv import load_dotenv
 
-from sentence_transformers import SentenceTransformer
 import numpy as np
-import faiss
-
-# Load the pre-trained model
-model = SentenceTransformer('all-MiniLM-L6-v2')
+from routing_cache import RoutingCache, ROUTING_CACHE
 
 load_dotenv()
 
@@ -363,6 +364,13 @@ tools_map = {
     "change_supplier_name_in_files": change_supplier_name_in_files,
 }
 
+# functions that write to the files of the user, their decisions are never reused from the routing cache
+file_writing_functions = {
+    "convert_column_to_currency_and_add_to_file",
+    "convert_column_to_price_per_unit_and_add_file",
+    "change_supplier_name_in_files",
+}
+
 function_calling_prompt = """As an AI assistant, please select the most suitable function and parameters from the list of available functions below, based on the user's input.
 
 ----------------------------------------
@@ -391,52 +399,152 @@ prompt_end = """```
 Remember to only give the json object as output, without any additional text."""
 
 
-# Create embeddings for the function descriptions
-descriptions = [tool["function"]["description"] for tool in tool_descriptions]
-description_embeddings = model.encode(descriptions)
+# The sentence encoder (sentence_transformers and torch), the Faiss index of the function descriptions and the routing
+# cache are created on the first prompt, so importing the agent (e.g. when the gui starts) does not load them
+_encoder = None
+_function_index = None
+_routing_cache = None
+_rag_lock = threading.RLock()
+
+def encoder():
+    global _encoder
+    with _rag_lock:
+        if _encoder is None:
+            _encoder = backend("sentence_transformers").SentenceTransformer('all-MiniLM-L6-v2')
+        return _encoder
+
+def function_index():
+    global _function_index, _routing_cache
+    with _rag_lock:
+        if _function_index is None:
+            # Create embeddings for the function descriptions
+            descriptions = [tool["function"]["description"] for tool in tool_descriptions]
+            description_embeddings = np.array(encoder().encode(descriptions)).astype('float32')
+
+            # Create a Faiss index
+            index = backend("faiss").IndexFlatL2(description_embeddings.shape[1])
+            index.add(description_embeddings)
 
-# Convert embeddings to a numpy array
-description_embeddings = np.array(description_embeddings).astype('float32')
+            # Decisions of the function selection are reused for similar prompts, see routing_cache.py
+            _routing_cache = RoutingCache(description_embeddings.shape[1]) if ROUTING_CACHE else None
+            _function_index = index
+        return _function_index
 
-# Create a Faiss index
-index = faiss.IndexFlatL2(description_embeddings.shape[1])
-index.add(description_embeddings)
+def get_routing_cache():
+    function_index()
+    return _routing_cache
 
 
-def retrieve_top_functions(prompt, top_n=5):
+def encode_prompt(prompt):
+    return encoder().encode([prompt]).astype('float32')
+
+def retrieve_top_functions(prompt, top_n=5, prompt_embedding=None):
     # Create embedding for the prompt
-    prompt_embedding = model.encode([prompt]).astype('float32')
+    if prompt_embedding is None:
+        prompt_embedding = encode_prompt(prompt)
 
     # Search for the top N similar functions
-    _, top_indices = index.search(prompt_embedding, top_n)
+    _, top_indices = function_index().search(prompt_embedding, top_n)
     return [tool_descriptions[i] for i in top_indices[0]]
 
+def routing_prompt(input_text, prompt_embedding):
+    top_functions = retrieve_top_functions(input_text, prompt_embedding=prompt_embedding)
+    return (
+        function_calling_prompt.format(
+            input=input_text, tools=top_functions
+        )
+        + prompt_end
+    )
+
+def parse_routing_answer(answer):
+    answer_json = answer_to_json(answer)
+    return answer_json["function"], answer_json.get("parameters", {})
+
 class FunctionAgent:
     def __init__(self, model):
         self.model = model
 
+    def cached_decision(self, input_text, prompt_embedding):
+        routing_cache = get_routing_cache()
+        if routing_cache is None:
+            return None
+        decision = routing_cache.lookup(input_text, prompt_embedding)
+        if decision is None:
+            return None
+        print(f"Reusing the function selection for \"{decision.prompt}\".")
+        return decision.function_name, decision.parameters
+
+    def checked_decision(self, history, answer):
+        # an answer naming an unknown function or parameters the function can not be called with is discarded from
+        # the LLM cache, so asking again sends a new request instead of returning the same answer
+        try:
+            function_name, parameters = parse_routing_answer(answer)
+            if function_name != "llm":
+                inspect.signature(tools_map[function_name]).bind(self.model, **parameters)
+        except Exception:
+            discard_answer(self.model, history)
+            raise
+        return function_name, parameters
+
+    def remember_decision(self, input_text, prompt_embedding, function_name, parameters):
+        routing_cache = get_routing_cache()
+        if routing_cache is not None and function_name not in file_writing_functions:
+            defaults = {} if function_name == "llm" else {
+                name: parameter.default for name, parameter in inspect.signature(tools_map[function_name]).parameters.items()
+                if parameter.default is not inspect.Parameter.empty
+            }
+            routing_cache.add(input_text, prompt_embedding, function_name, parameters, defaults)
+
     def __call__(self, messages: list[dict[str, str]]):
         try:
             input_text = messages[-1]["content"]
-            top_functions = retrieve_top_functions(input_text)
-            prompt = (
-                function_calling_prompt.format(
-                    input=input_text, tools=top_functions
-                )
-                + prompt_end
-            )
-            answer = ""
-            for x in self.model([{"role": "user", "content": prompt}]):
-                answer += x
-            answer_json = answer_to_json(answer)
-            function_name = answer_json["function"]
+            prompt_embedding = encode_prompt(input_text)
+            decision = cached = self.cached_decision(input_text, prompt_embedding)
+            if decision is None:
+                history = [{"role": "user", "content": routing_prompt(input_text, prompt_embedding)}]
+                decision = self.checked_decision(history, self.model.complete(history))
+            function_name, parameters = decision
+            if function_name == "llm":
+                if cached is None:
+                    self.remember_decision(input_text, prompt_embedding, function_name, parameters)
+                # stream the answer, the gui shows the text as soon as it is generated
+                for x in self.model.stream(messages):
+                    yield x
+            else:
+                print(f"\n\n--- Calling function {function_name} with parameters {parameters} ---\n\n")
+                result = tools_map[function_name](self.model, **parameters)
+                if cached is None: # only decisions the function could be called with are cached
+                    self.remember_decision(input_text, prompt_embedding, function_name, parameters)
+                yield result
+        except Exception as e:
+            traceback.print_exc()
+            yield str(e)
+
+    '''
+    Same as calling the agent, for async models (see async_llm_factory): the LLM requests are awaited,
+    the functions run in a worker thread and send their requests to the event loop of the agent.
+    '''
+    async def acall(self, messages: list[dict[str, str]]):
+        try:
+            input_text = messages[-1]["content"]
+            prompt_embedding = await asyncio.to_thread(encode_prompt, input_text)
+            decision = cached = self.cached_decision(input_text, prompt_embedding)
+            if decision is None:
+                history = [{"role": "user", "content": routing_prompt(input_text, prompt_embedding)}]
+                decision = self.checked_decision(history, await self.model.complete(history))
+            function_name, parameters = decision
             if function_name == "llm":
-                for x in self.model(messages):
+                if cached is None:
+                    self.remember_decision(input_text, prompt_embedding, function_name, parameters)
+                async for x in self.model.stream(messages):
                     yield x
             else:
-                parameters = answer_json["parameters"]
                 print(f"\n\n--- Calling function {function_name} with parameters {parameters} ---\n\n")
-                yield tools_map[function_name](self.model, **parameters)
+                model = BlockingLLM(self.model, asyncio.get_running_loop())
+                result = await asyncio.to_thread(tools_map[function_name], model, **parameters)
+                if cached is None:
+                    self.remember_decision(input_text, prompt_embedding, function_name, parameters)
+                yield result
         except Exception as e:
             traceback.print_exc()
             yield str(e)
@@ -1,12 +1,16 @@
 import gradio as gr
 import xlsxwriter
-from data_loader import get_data, ColumnType, MetadataType
+from data_loader import get_data, lowercase_equals, ColumnType, MetadataType
+from fact_table import get_sales_facts, sales_in_currency
+from lookup_index import get_lookup_index
+from metadata_catalog import get_catalog, countries_or_global
+from rollup_cube import get_rollup_cube
+from excel_preparations import read_table_file, write_table_file
 from utils import get_currency_conversion_rate
 from datetime import datetime
 import calendar
 import json
 import plotly.express as px
-import pandas as pd
 
 def country_code_to_name(code: str) -> str:
     if code == "CH":
@@ -39,21 +43,16 @@ def get_suppliers_by_material(model, material: str) -> str:
         return "No data available"
     else:
         # use only files with material and supplier columns
-        def metadata_filter(filename):
-            mt = metadata[filename]
-            columns = mt["columns"].keys()
-            return "material" in columns and "supplier" in columns
-        
-        files = list(filter(metadata_filter, files))
+        files = get_catalog(metadata).select(files, columns=[ColumnType.MATERIAL, ColumnType.SUPPLIER])
+
+        material_rows = get_lookup_index(metadata, data_frames).rows_by_material(material, files)
 
         suppliers = ""
         for file in files:
-            df = data_frames[file]
-            filtered_rows = data_frames[file]["Material"].str.lower()
-            result = df[filtered_rows == material.lower()]
-        
-            if result.shape[0] > 0:
-                suppliers += " - In file '" + file + "': " + ", ".join(result["Supplier"].to_list()) + "\n"
+            if file in material_rows:
+                result = data_frames[file].iloc[material_rows[file]]
+                supplier_col = metadata[file]["columns"][ColumnType.SUPPLIER]
+                suppliers += " - In file '" + file + "': " + ", ".join(result[supplier_col].to_list()) + "\n"
 
         if not suppliers:
             return f"No suppliers found. It might be that no relavant excel file was uploaded, or the material '{material}' was not found."
@@ -72,34 +71,16 @@ def get_suppliers_by_material_and_year(model, material: str, year: int) -> str:
         return "No data available"
     else:
         # use only files with material, supplier columns and matching year
-        def column_filter(filename):
-            mt = metadata[filename]
-            columns = mt["columns"].keys()
-            return "material" in columns and "supplier" in columns
-        
-        files = list(filter(column_filter, files))
+        files = get_catalog(metadata).select(files, columns=[ColumnType.MATERIAL, ColumnType.SUPPLIER], year=year)
 
-        def year_filter(filename):
-            mt = metadata[filename]
-            try:
-                year_from = int(mt[MetadataType.YEAR_FROM])
-                year_to = int(mt[MetadataType.YEAR_TO])
-                year_range = range(year_from, year_to + 1) # +1 because year_to is exclusive
-                return year in year_range
-            except:
-                return False # if year_from or year_to is "unknown"
-
-        files = list(filter(year_filter, files))
+        material_rows = get_lookup_index(metadata, data_frames).rows_by_material(material, files)
 
         suppliers = ""
         for file in files:
-            df = data_frames[file]
-
-            filtered_rows = df["Material"].str.lower()
-            result = df[filtered_rows == material.lower()]
-        
-            if result.shape[0] > 0:
-                suppliers += " - In file '" + file + "': " + ", ".join(result["Supplier"].to_list()) + "\n"
+            if file in material_rows:
+                result = data_frames[file].iloc[material_rows[file]]
+                supplier_col = metadata[file]["columns"][ColumnType.SUPPLIER]
+                suppliers += " - In file '" + file + "': " + ", ".join(result[supplier_col].to_list()) + "\n"
 
         if not suppliers:
             return f"No suppliers found. It might be that no relevant excel file was uploaded, or the material '{material}' was not found."
@@ -115,25 +96,8 @@ def get_material_cost_by_year(model, material: str, year: int) -> str:
     if not data_frames:
         return "No data available"
     else:
-        # use only files with material and price columns
-        def metadata_filter(filename):
-            mt = metadata[filename]
-            columns = mt["columns"].keys()
-            return "material" in columns and "cost_per_unit_dollar" in columns
-    
-        files = list(filter(metadata_filter, files))
-
-        def year_filter(filename):
-            mt = metadata[filename]
-            try:
-                year_from = int(mt[MetadataType.YEAR_FROM])
-                year_to = int(mt[MetadataType.YEAR_TO])
-                year_range = range(year_from, year_to + 1) # +1 because year_to is exclusive
-                return year in year_range
-            except:
-                return False # if year_from or year_to is "unknown"
-
-        files = list(filter(year_filter, files))
+        # use only files with material and price columns and matching year
+        files = get_catalog(metadata).select(files, columns=[ColumnType.MATERIAL, ColumnType.COST_PER_UNIT_DOLLAR], year=year)
 
         if len(files) > 1:
             return "Too many data sources available: " + ", ".join(files)
@@ -141,14 +105,14 @@ def get_material_cost_by_year(model, material: str, year: int) -> str:
             return "No data source available."
 
         file = files[0]
-        df = data_frames[file]
-        filtered_rows = df["Material"].str.lower()
-        result = df[filtered_rows == material.lower()]
+        material_rows = get_lookup_index(metadata, data_frames).rows_by_material(material, files)
 
-        if result.shape[0] == 0:
+        if file not in material_rows:
             return f"No cost found for {material} in {year}."
 
-        return f"Cost of {material} in {year}: {result['Cost per Unit ($)'].values[0]} USD found in `{file}`"
+        result = data_frames[file].iloc[material_rows[file]]
+        cost_col = metadata[file]["columns"][ColumnType.COST_PER_UNIT_DOLLAR]
+        return f"Cost of {material} in {year}: {result[cost_col].values[0]} USD found in `{file}`"
 
 
 def quarter_to_month(quarter: str) -> (int, int):
@@ -173,14 +137,8 @@ def compare_price_per_unit_by_quarters(model, unit_type: str, quarter1: str, yea
     if not data_frames:
         return "No data available"
     else:
-        # use only files with material and supplier columns
-        def metadata_filter(filename):
-            mt = metadata[filename]
-
-            columns = mt["columns"].keys()
-            return mt["type"].lower() == "costs_per_unit" and "year" in columns and "month" in columns
-        
-        files = list(filter(metadata_filter, files))
+        # use only cost files with year and month columns
+        files = get_catalog(metadata).select(files, data_type="costs_per_unit", columns=[ColumnType.YEAR, ColumnType.MONTH])
 
         year1 = int(year1)
         year2 = int(year2)
@@ -199,18 +157,26 @@ def compare_price_per_unit_by_quarters(model, unit_type: str, quarter1: str, yea
         q1_month_from, q1_month_to = quarter_to_month(quarter1)
         q2_month_from, q2_month_to = quarter_to_month(quarter2)
 
-        month_col = metadata[file]["columns"]["month"]
-        year_col = metadata[file]["columns"]["year"]
-        quarter_filter_q1 = df[month_col].between(q1_month_from, q1_month_to) & (df[year_col] == year1)
-        q1 = df[quarter_filter_q1]
-        quarter_filter_q2 = df[month_col].between(q2_month_from, q2_month_to) & (df[year_col] == year2)
-        q2 = df[quarter_filter_q2]
-
-        if q1.shape[0] == 0 or q2.shape[0] == 0:
+        try:
+            # quarterly sums of the rollup cube
+            cube = get_rollup_cube(metadata, data_frames)
+            avg_q1 = cube.quarterly_mean(file, col, year1, q1_month_to // 3)
+            avg_q2 = cube.quarterly_mean(file, col, year2, q2_month_to // 3)
+        except KeyError:
+            month_col = metadata[file]["columns"]["month"]
+            year_col = metadata[file]["columns"]["year"]
+            quarter_filter_q1 = df[month_col].between(q1_month_from, q1_month_to) & (df[year_col] == year1)
+            q1 = df[quarter_filter_q1]
+            quarter_filter_q2 = df[month_col].between(q2_month_from, q2_month_to) & (df[year_col] == year2)
+            q2 = df[quarter_filter_q2]
+            avg_q1 = q1[col].mean() if q1.shape[0] > 0 else None
+            avg_q2 = q2[col].mean() if q2.shape[0] > 0 else None
+
+        if avg_q1 is None or avg_q2 is None:
             return f"Could not find data from {quarter1} {year1} - {quarter2} {year2}."
 
-        avg_q1 = round(q1[col].mean(), 2)
-        avg_q2 = round(q2[col].mean(), 2)
+        avg_q1 = round(avg_q1, 2)
+        avg_q2 = round(avg_q2, 2)
 
         return f"Average price per unit in {quarter1} {year1}: {avg_q1}\nAverage price per unit in {quarter2} {year2}: {avg_q2}"
 
@@ -231,34 +197,22 @@ def get_material_amount_sold(model, material, year: int, month_from: int, month_
         year = int(year)
         month_from = int(month_from)
         month_to = int(month_to)
-        def metadata_filter(filename):
-            mt = metadata[filename]
-            countries_no_match = country_code != "global" and mt[MetadataType.COUNTRY_CODE] != "global" and mt[MetadataType.COUNTRY_CODE] != country_code
-            if mt[MetadataType.YEAR_FROM] != int(year) or countries_no_match:
-                return False
-
-            columns = mt["columns"].keys()
-            return ColumnType.MATERIAL in columns and ColumnType.UNITS_SOLD in columns
-        
-        files = list(filter(metadata_filter, files))
+        files = get_catalog(metadata).select(
+            files, countries=countries_or_global(country_code), columns=[ColumnType.MATERIAL, ColumnType.UNITS_SOLD], year_from=year
+        )
 
         if len(files) == 0:
             return "No data source available."
 
+        facts = get_sales_facts(metadata, data_frames)
+        result = facts[facts["file"].isin(files) & (facts["material"] == material.lower()) & facts["month"].between(month_from, month_to)]
+        units_per_file = result.groupby("file", observed=True)["units_sold"].sum()
+
         number_of_sold_units_txt = ""
         for file in files:
-            df = data_frames[file]
-            mt = metadata[file]
-            columns = mt["columns"]
-
-            material_col = data_frames[file][columns[ColumnType.MATERIAL]].str.lower()
-            month_col = data_frames[file][columns[ColumnType.MONTH]]
-            result = df[(material_col == material.lower()) & (month_col.between(month_from, month_to))]
-        
-            if result.shape[0] > 0:
-                unit_column = columns[ColumnType.UNITS_SOLD]
-                country = country_code_to_name(mt[MetadataType.COUNTRY_CODE])
-                number_of_sold_units_txt += f"{country}: {result[unit_column].sum()}\n"
+            if file in units_per_file.index:
+                country = country_code_to_name(metadata[file][MetadataType.COUNTRY_CODE])
+                number_of_sold_units_txt += f"{country}: {units_per_file[file]}\n"
         
         if not number_of_sold_units_txt:
             return f"No sales found for {material} from {month_from} to {month_to} in {year}."
@@ -280,54 +234,31 @@ def get_material_sales_per_country_in_currency(model, material: str, year: int,
     if not data_frames:
         return "No data available"
     else:
-        def metadata_filter(filename):
-            mt = metadata[filename]
-            countries_no_match = country_code != "global" and mt[MetadataType.COUNTRY_CODE] != "global" and mt[MetadataType.COUNTRY_CODE] != country_code
-            if countries_no_match:
-                return False
-
-            columns = mt["columns"].keys()
-            return ColumnType.MATERIAL in columns and (ColumnType.UNITS_SOLD in columns)
-        
-        files = list(filter(metadata_filter, files))
-
-        def year_filter(filename):
-            mt = metadata[filename]
-            try:
-                year_from = int(mt[MetadataType.YEAR_FROM])
-                year_to = int(mt[MetadataType.YEAR_TO])
-                year_range = range(year_from, year_to + 1) # +1 because year_to is exclusive
-                return year in year_range
-            except:
-                return False # if year_from or year_to is "unknown"
-
-        files = list(filter(year_filter, files))
+        files = get_catalog(metadata).select(
+            files, countries=countries_or_global(country_code), columns=[ColumnType.MATERIAL, ColumnType.UNITS_SOLD], year=year
+        )
 
         if len(files) == 0:
             return "No data source available."
 
-        number_of_sold_units_txt = ""
-        for file in files:
-            df = data_frames[file]
-            mt = metadata[file]
-            columns = mt["columns"]
-
-            material_col = data_frames[file][columns[ColumnType.MATERIAL]].str.lower()
-            result = df[(material_col == material.lower())]
-
-            if result.shape[0] > 0:
-                if ColumnType.TOTAL_SALES_DOLLAR in columns:
-                    sales_column = columns[ColumnType.TOTAL_SALES_DOLLAR]
-                    from_currency = "USD"
-                elif ColumnType.TOTAL_SALES_EURO in columns:
-                    sales_column = columns[ColumnType.TOTAL_SALES_EURO]
-                    from_currency = "EUR"
+        facts = get_sales_facts(metadata, data_frames)
+        result = facts[facts["file"].isin(files) & (facts["material"] == material.lower()) & facts["currency"].notna()]
 
-                rate = get_currency_conversion_rate(from_currency, to_currency)
-                total_sales = result[sales_column].multiply(rate).sum().round(2)
+        converted, rates = sales_in_currency(result, to_currency)
+        result = result.assign(converted=converted)
+        totals = result.groupby("file", observed=True).agg(sales=("sales", "sum"), converted=("converted", "sum"), currency=("currency", "first"))
 
-
-                country = country_code_to_name(mt[MetadataType.COUNTRY_CODE])
+        number_of_sold_units_txt = ""
+        for file in files:
+            if file in totals.index:
+                total = totals.loc[file]
+                if rates[total["currency"]] == 1:
+                    total_sales = total["sales"]
+                    total_sales = int(total_sales) if float(total_sales).is_integer() else round(total_sales, 2)
+                else:
+                    total_sales = round(total["converted"], 2)
+
+                country = country_code_to_name(metadata[file][MetadataType.COUNTRY_CODE])
                 number_of_sold_units_txt += f"{country}: {total_sales} {to_currency}\n"
         
         if not number_of_sold_units_txt:
@@ -352,53 +283,45 @@ def get_total_sales_per_months_for_country_for_year_for_material_in_currency_dat
     if not data_frames:
         raise FileNotFoundError("No data source available.")
 
-    def sales_filter(filename):
-        mt = metadata[filename]
-        return mt[MetadataType.TYPE] == "sales"
-
-    files = list(filter(sales_filter, files))
-
-    def country_filter(filename):
-        mt = metadata[filename]
-        return mt["country_code"] == country_code
-
-    files = list(filter(country_filter, files))
-
-    def year_filter(filename):
-        mt = metadata[filename]
-        try:
-            year_from = int(mt[MetadataType.YEAR_FROM])
-            year_to = int(mt[MetadataType.YEAR_TO])
-            year_range = range(year_from, year_to + 1) # +1 because year_to is exclusive
-            return year in year_range
-        except:
-            return False # if year_from or year_to is "unknown"
-
-    files = list(filter(year_filter, files))
+    files = get_catalog(metadata).select(files, data_type="sales", countries=[country_code], year=year)
 
     if len(files) == 0:
         raise FileNotFoundError("After filtering for given criteria, no data source was found.")
     
-    df = data_frames[files[0]]
     mt = metadata[files[0]]
 
-    if material:
-        df = df[df[mt["columns"]["material"]].str.lower() == material.lower()]
-
     # Dynamically retrieve "Total Sales" column name
     sales_column = next((col for col in mt["columns"].values() if "umsatz" in col.lower() or "sales" in col.lower()), None)
     if not sales_column:
         raise AssertionError("Total Sales column not found in metadata.")
 
-    # Convert the "Month" column to integers
     month_col = mt["columns"]["month"]
-    df[month_col] = df[month_col].apply(lambda x: list(calendar.month_name).index(x) if isinstance(x, str) else x)
+    units_column = mt["columns"][ColumnType.UNITS_SOLD]
+
+    # Use the monthly sums of the rollup cube if they contain the same sales column
+    grouped_df = None
+    if sales_column == mt["columns"].get(ColumnType.TOTAL_SALES_DOLLAR, mt["columns"].get(ColumnType.TOTAL_SALES_EURO)):
+        cube = get_rollup_cube(metadata, data_frames)
+        grouped_df = cube.sales(files[0], year, by="month", material=material)
+
+    if grouped_df is not None:
+        for value in ["units_sold", "sales"]:
+            if cube.is_integer(files[0], value):
+                grouped_df[value] = grouped_df[value].astype("int64") # the cube stores mixed files as float
+        grouped_df = grouped_df.rename(columns={"month": month_col, "units_sold": units_column, "sales": sales_column})
+    else:
+        df = data_frames[files[0]].copy() # data frames are shared through the data cache
+        if material:
+            df = df[lowercase_equals(df[mt["columns"]["material"]], material)]
+
+        # Convert the "Month" column to integers
+        df[month_col] = df[month_col].apply(lambda x: list(calendar.month_name).index(x) if isinstance(x, str) else x)
 
-    # Group by month and sum the sales and units
-    grouped_df = df.groupby(mt["columns"]["month"]).agg({
-        mt["columns"][ColumnType.UNITS_SOLD]: 'sum',
-        sales_column: 'sum',
-    }).reset_index()
+        # Group by month and sum the sales and units
+        grouped_df = df.groupby(month_col).agg({
+            units_column: 'sum',
+            sales_column: 'sum',
+        }).reset_index()
 
     # Filter by month range
     grouped_df = grouped_df[(grouped_df[mt["columns"]["month"]] >= month_from) & (grouped_df[mt["columns"]["month"]] <= month_to)]
@@ -516,17 +439,10 @@ def convert_column_to_currency_and_add_to_file(model, currency_code: str, year:
     if not data_frames:
         return "No data available"
     else:
-        def metadata_filter(filename):
-            mt = metadata[filename]
-            
-            # Return False if year or country codes don't match
-            if str(mt[MetadataType.YEAR_FROM]) != str(year) or country_code == "global" or mt[MetadataType.COUNTRY_CODE] == "global" or mt[MetadataType.COUNTRY_CODE] != country_code:
-                return False
-
-            columns = mt["columns"].keys()
-            return ColumnType.TOTAL_SALES_DOLLAR in columns or ColumnType.TOTAL_SALES_EURO in columns
-        
-        files = list(filter(metadata_filter, files))
+        # only files of a single country
+        files = get_catalog(metadata).select(
+            files, countries=[] if country_code == "global" else [country_code], any_columns=[ColumnType.TOTAL_SALES_DOLLAR, ColumnType.TOTAL_SALES_EURO], year_from=year
+        )
 
         if len(files) == 0:
             return "No data source available."
@@ -534,7 +450,7 @@ def convert_column_to_currency_and_add_to_file(model, currency_code: str, year:
         if len(files) > 1:
             return "Too many data sources available: " + ", ".join(files)
 
-        df = data_frames[files[0]]
+        df = data_frames[files[0]].copy() # data frames are shared through the data cache
         mt = metadata[files[0]]
         columns = mt["columns"]
 
@@ -560,9 +476,7 @@ def convert_column_to_currency_and_add_to_file(model, currency_code: str, year:
         month_col = columns[ColumnType.MONTH]
         df[month_col] = df[month_col].apply(lambda x: calendar.month_name[int(x)] if isinstance(x, int) else x)
 
-        writer = pd.ExcelWriter(file_path, engine="xlsxwriter")
-        df.to_excel(writer, sheet_name="Sales Data", index=False)
-        writer.close()
+        file_path = write_table_file(df, file_path, sheet_name="Sales Data") # .xls files are written as .xlsx
 
         return f'A column has been added to the file. <a href="gradio_api/file={file_path}">Download here</a> or download it below in the “File” section.'
 
@@ -580,17 +494,11 @@ def convert_column_to_price_per_unit_and_add_file(model, year: int, country_code
     if not data_frames:
         return "No data available"
     else:
-        def metadata_filter(filename):
-            mt = metadata[filename]
-            
-            # Return False if year or country codes don't match
-            if str(mt[MetadataType.YEAR_FROM]) != str(year) or country_code == "global" or mt[MetadataType.COUNTRY_CODE] == "global" or mt[MetadataType.COUNTRY_CODE] != country_code:
-                return False
-
-            columns = mt["columns"].keys()
-            return (ColumnType.TOTAL_SALES_DOLLAR in columns or ColumnType.TOTAL_SALES_EURO in columns) and ColumnType.UNITS_SOLD in columns
-        
-        files = list(filter(metadata_filter, files))
+        # only files of a single country
+        files = get_catalog(metadata).select(
+            files, countries=[] if country_code == "global" else [country_code], columns=[ColumnType.UNITS_SOLD],
+            any_columns=[ColumnType.TOTAL_SALES_DOLLAR, ColumnType.TOTAL_SALES_EURO], year_from=year
+        )
 
         if len(files) == 0:
             return "No data source available."
@@ -598,7 +506,7 @@ def convert_column_to_price_per_unit_and_add_file(model, year: int, country_code
         if len(files) > 1:
             return "Too many data sources available: " + ", ".join(files)
 
-        df = data_frames[files[0]]
+        df = data_frames[files[0]].copy() # data frames are shared through the data cache
         mt = metadata[files[0]]
         columns = mt["columns"]
 
@@ -619,9 +527,7 @@ def convert_column_to_price_per_unit_and_add_file(model, year: int, country_code
         if not file_path:
             return f"File path for {files[0]} not found in file_mapping.json."
 
-        writer = pd.ExcelWriter(file_path, engine="xlsxwriter")
-        df.to_excel(writer, sheet_name="Sales Data", index=False)
-        writer.close()
+        file_path = write_table_file(df, file_path, sheet_name="Sales Data")
 
         return f'A column has been added to the file. <a href="gradio_api/file={file_path}">Download here</a> or download it below in the “File” section.'
 
@@ -635,24 +541,19 @@ def change_supplier_name_in_files(model, supplier_name_from: str, supplier_name_
     if not data_frames:
         return "No data available"
     else:
-        def metadata_filter(filename):
-            mt = metadata[filename]
-            columns = mt["columns"].keys()
-            return "supplier" in columns
-        
-        files = list(filter(metadata_filter, files))
+        files = get_catalog(metadata).select(files, columns=[ColumnType.SUPPLIER])
 
         if len(files) == 0:
             return "No data source available."
         
         download_links = ""
         for file in files:
-            df = data_frames[file]
+            df = data_frames[file].copy() # data frames are shared through the data cache
             mt = metadata[file]
             columns = mt["columns"]
 
             supplier_col = columns["supplier"]
-            df[supplier_col] = df[supplier_col].replace(supplier_name_from, supplier_name_to)
+            df[supplier_col] = df[supplier_col].astype(object).replace(supplier_name_from, supplier_name_to) # may be categorical
 
             with open('tmp/file_mapping.json', 'r') as f:
                 file_mapping = json.load(f)
@@ -661,9 +562,7 @@ def change_supplier_name_in_files(model, supplier_name_from: str, supplier_name_
             if not file_path:
                 return f"File path for {file} not found in file_mapping.json."
 
-            writer = pd.ExcelWriter(file_path, engine="xlsxwriter")
-            df.to_excel(writer, sheet_name="Sales Data", index=False)
-            writer.close()
+            file_path = write_table_file(df, file_path, sheet_name="Sales Data")
             download_links += f'<li><a href="gradio_api/file={file_path}">Download {file}</a><br></li>'
 
         return f'Supplier name "{supplier_name_from}" has been changed to "{supplier_name_to}" all files. Download them here: <br><ul>{download_links}</ul>'
@@ -679,11 +578,7 @@ def get_excel_formula(model, country_code: str, year: int, question: str) -> str
     if not data_frames:
         return "No data available"
     else:
-        def metadata_filter(filename):
-            mt = metadata[filename]
-            return mt[MetadataType.COUNTRY_CODE] == country_code and str(mt[MetadataType.YEAR_FROM]) == str(year)
-        
-    files = list(filter(metadata_filter, files))
+        files = get_catalog(metadata).select(files, countries=[country_code], year_from=year)
     print(f"fffffffffiles: {files}")
 
     if len(files) == 0:
@@ -692,7 +587,7 @@ def get_excel_formula(model, country_code: str, year: int, question: str) -> str
     if len(files) > 1:
         return "Too many data sources available: " + ", ".join(files)
 
-    df = pd.read_excel(f"tmp/{files[0]}")
+    df = read_table_file(f"tmp/{files[0]}")
     print(f"df: {df}")
 
     prompt = f"""As an AI assistant, please provide the Excel formula for the following question:
@@ -702,7 +597,5 @@ def get_excel_formula(model, country_code: str, year: int, question: str) -> str
         {df.to_string()}
         """
 
-    answer = ""
-    for x in model([{"role": "user", "content": prompt}]):
-        answer += x
+    answer = model.complete([{"role": "user", "content": prompt}])
     return answer    
\ No newline at end of file
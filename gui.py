@@ -1,17 +1,23 @@
 import gradio as gr
 import os
 import shutil
+import time
 from function_calling_agent import FunctionAgent
-from llm_factory import llm_factory
+from llm_factory import llm_factory, async_llm_factory
 from typing import List, Dict, Any
 from dotenv import load_dotenv
-import json
-from data_loader import extract_metadata
-from excel_preparations import ExcelPreparations
+from ingestion_queue import IngestionQueue
 
 load_dotenv()
 
-llm = llm_factory(os.getenv("MODEL_NAME", "phi3"))
+# with LLM_ASYNC=true the chats await the LLM on the event loop of the gui instead of blocking a worker thread each
+LLM_ASYNC = os.getenv("LLM_ASYNC", "false").lower() == "true"
+
+if LLM_ASYNC:
+    llm = async_llm_factory(os.getenv("MODEL_NAME", "phi3"))
+else:
+    llm = llm_factory(os.getenv("MODEL_NAME", "phi3"))
+ingestion_queue = IngestionQueue(llm)
 calling_agent = FunctionAgent(llm)
 
 # Define the tmp folder
@@ -36,34 +42,18 @@ with gr.Blocks(title="GEDA") as demo:
     chatbot: gr.Chatbot = gr.Chatbot(height="65vh")
     msg: gr.Textbox = gr.Textbox()
     send_button: gr.Button = gr.Button("Send", variant="primary")
-    file_upload: gr.File = gr.File(file_types=[".xls", ".xlsx"], file_count="multiple")
+    file_upload: gr.File = gr.File(file_types=[".xls", ".xlsx", ".csv", ".parquet"], file_count="multiple")
     clear: gr.Button = gr.Button("Clear Chat")
 
+    ingestion_progress: gr.Markdown = gr.Markdown()
+
     def handle_file_upload(files):
-        yield gr.update(interactive = False), gr.update(interactive = False)
-        tmp_files = []
-        for file in files:
-            src_path = file.name
-            dst_path = os.path.join(tmp_folder, os.path.basename(file.name))
-            
-            # Check if source and destination are the same
-            if os.path.abspath(src_path) != os.path.abspath(dst_path):
-                shutil.copy(src_path, dst_path)
-            tmp_files.append(dst_path.split("/")[-1])
-
-            # Create a dictionary to map filename to its path
-            file_mapping = {os.path.basename(file.name): file for file in files}
-
-            # Save the dictionary as a JSON file in the tmp folder
-            json_path = os.path.join(tmp_folder, "file_mapping.json")
-            with open(json_path, "w") as json_file:
-                json.dump(file_mapping, json_file)
-
-        excel_preparation = ExcelPreparations()
-        data_frames, info_texts = excel_preparation.read_excel(tmp_files)
-        extract_metadata(llm, tmp_files, data_frames, info_texts)
-        yield gr.update(interactive = True), gr.update(interactive = True)
-        
+        # files are ingested in the background, questions about the files that are ready can be asked in the meantime
+        jobs = ingestion_queue.submit([file.name for file in files])
+        while not all(job.done for job in jobs):
+            yield ingestion_queue.progress(jobs)
+            time.sleep(0.5)
+        yield ingestion_queue.progress(jobs)
 
     def user(
         user_message: str, history: List[Dict[str, Any]]
@@ -79,17 +69,26 @@ with gr.Blocks(title="GEDA") as demo:
                 history[-1]["content"] = x
             yield history
 
+    async def bot_async(history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        history.append({"role": "assistant", "content": ""})
+        async for x in calling_agent.acall(history[:-1]):
+            if type(x) == str:  # allow llm answer stream
+                history[-1]["content"] += x
+            else:  # allow gradio blocks in chat
+                history[-1]["content"] = x
+            yield history
+
     msg.submit(user, [msg, chatbot], [msg, chatbot], queue=False).then(
-        bot, chatbot, chatbot
+        bot_async if LLM_ASYNC else bot, chatbot, chatbot, concurrency_limit=None if LLM_ASYNC else 1
     )
     send_button.click(user, [msg, chatbot], [msg, chatbot], queue=False).then(
-        bot, chatbot, chatbot
+        bot_async if LLM_ASYNC else bot, chatbot, chatbot, concurrency_limit=None if LLM_ASYNC else 1
     )
 
     clear.click(lambda: None, None, chatbot, queue=False)
 
     file_upload.upload(
-        handle_file_upload, inputs=[file_upload], outputs=[send_button, msg])
+        handle_file_upload, inputs=[file_upload], outputs=[ingestion_progress])
 
 def main_gui() -> None:
     demo.launch(favicon_path="./favicon.png")
@@ -98,4 +97,5 @@ if __name__ == "__main__":
     try:
         main_gui()
     finally:
+        ingestion_queue.shutdown()
         cleanup()  # Delete the tmp folder and file mapping JSON after the function is killed
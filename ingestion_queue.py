@@ -0,0 +1,189 @@
+import os
+import json
+import asyncio
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from checksums import file_checksum
+from data_cache import data_cache
+from data_loader import extract_metadata, extract_metadata_async, pending_files, warm_sidecar, METADATA_MAX_CONCURRENCY
+from excel_preparations import ExcelPreparations, is_supported_file
+from llm_factory import BlockingLLM
+from metadata_store import metadata_store
+
+# stages every uploaded file goes through, a file can be queried once all stages are done
+STAGES = ["copy", "parse", "metadata", "index"]
+
+# number of files ingested at the same time, by default as many as metadata requests are sent to the LLM at the same time
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", str(METADATA_MAX_CONCURRENCY)))
+
+# files up to this size are preprocessed into the sidecar cache during the ingestion, larger files are parsed when first used
+INGESTION_WARM_MAX_MB = float(os.getenv("INGESTION_WARM_MAX_MB", "10"))
+
+
+class IngestionJob():
+    def __init__(self, src_path: str, filename: str):
+        self.src_path = src_path
+        self.filename = filename
+        self.path = os.path.join(os.getcwd(), "tmp", filename)
+        self.checksum = None
+        self.header = None # columns as a data frame without rows, only read if the metadata is not known
+        self.info_text = None
+        self.metadata = None
+        self.stage = None # stage that is currently running, None while queued
+        self.completed_stages = 0
+        self.status = "queued" # queued, running, ready or failed
+        self.error = None
+        self.submitted_at = time.time()
+        self.finished_at = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("ready", "failed")
+
+    def describe(self) -> str:
+        if self.status == "running":
+            return f"{self.filename}: {self.stage} ({self.completed_stages}/{len(STAGES)})"
+        elif self.status == "failed":
+            return f"{self.filename}: failed in {self.stage} ({self.error})"
+        elif self.status == "ready":
+            return f"{self.filename}: ready ({self.finished_at - self.submitted_at:.1f}s)"
+        return f"{self.filename}: queued"
+
+
+'''
+Background ingestion of uploaded files, so the gui stays responsive while files are copied, parsed and described.
+Every file moves through the STAGES on its own, several files are ingested in parallel:
+- copy: copy the upload to tmp/ and add it to tmp/file_mapping.json
+- parse: read the header and the info text of the file (skipped if its metadata is known already)
+- metadata: classify the file or ask the LLM for its metadata and add it to the data cache. Parsed files waiting for their
+  metadata are requested together with one call of extract_metadata, so METADATA_BATCH_SIZE applies to uploads as well
+- index: write the preprocessed sidecar of small files, so the first question does not parse them. The data frame is not kept,
+  it is only loaded when a function accesses the file
+With an async model (see async_llm_factory) the metadata is requested with extract_metadata_async on the background event loop.
+Files are in pending_files until they are ready, get_data skips them so questions can be answered on the files that are ready.
+'''
+class IngestionQueue():
+    def __init__(self, model, max_workers: int = INGESTION_WORKERS):
+        self.model = model
+        self.jobs = []
+        self._lock = threading.Lock()
+        self._mapping_lock = threading.Lock()
+        self._metadata_waiting = [] # (job, remaining stages) of parsed files waiting for their metadata
+        self._metadata_requesting = False
+        self._executor = ThreadPoolExecutor(max_workers=max(max_workers, 1), thread_name_prefix="ingestion")
+
+    def submit(self, src_paths: list) -> list:
+        jobs = [IngestionJob(src_path, os.path.basename(src_path)) for src_path in src_paths]
+        with self._lock:
+            for job in jobs:
+                self.jobs.append(job)
+                pending_files.add(job.filename)
+        for job in jobs:
+            self._executor.submit(self.run, job, STAGES)
+        return jobs
+
+    def run(self, job: IngestionJob, stages: list) -> None:
+        job.status = "running"
+        try:
+            for position, stage in enumerate(stages):
+                job.stage = stage
+                if stage == "metadata" and job.metadata is None:
+                    # the worker is released, the remaining stages are submitted again once the metadata is known
+                    self.queue_metadata(job, stages[position:])
+                    return
+                getattr(self, stage)(job)
+                job.completed_stages += 1
+            job.status = "ready"
+        except Exception as e:
+            self.fail(job, e)
+        self.finish(job)
+
+    def fail(self, job: IngestionJob, error: Exception) -> None:
+        print(f"Ingestion of {job.filename} failed in stage {job.stage}: {error}")
+        job.status, job.error = "failed", str(error)
+
+    def finish(self, job: IngestionJob) -> None:
+        job.finished_at = time.time()
+        with self._lock:
+            if not any(other.filename == job.filename and not other.done for other in self.jobs):
+                pending_files.discard(job.filename) # failed files are retried by get_data
+
+    def copy(self, job: IngestionJob) -> None:
+        # Check if source and destination are the same
+        if os.path.abspath(job.src_path) != os.path.abspath(job.path):
+            shutil.copy(job.src_path, job.path)
+
+        # map the filename to the path of the upload, the functions write edited files back to it
+        with self._mapping_lock:
+            json_path = os.path.join(os.getcwd(), "tmp", "file_mapping.json")
+            file_mapping = {}
+            if os.path.exists(json_path):
+                with open(json_path, "r") as json_file:
+                    file_mapping = json.load(json_file)
+            file_mapping[job.filename] = job.src_path
+            with open(json_path, "w") as json_file:
+                json.dump(file_mapping, json_file)
+
+    def parse(self, job: IngestionJob) -> None:
+        if not is_supported_file(job.path):
+            raise ValueError("unsupported file type")
+        job.checksum = file_checksum(job.path)
+        job.metadata = metadata_store.get(job.checksum, job.filename)
+        if job.metadata is None:
+            job.header, job.info_text = ExcelPreparations().read_header(job.path)
+
+    def queue_metadata(self, job: IngestionJob, stages: list) -> None:
+        with self._lock:
+            self._metadata_waiting.append((job, stages))
+            start = not self._metadata_requesting
+            self._metadata_requesting = True
+        if start: # queued behind the files submitted so far, so their metadata is requested in the same batch
+            self._executor.submit(self.request_metadata)
+
+    '''
+    Request the metadata of all files waiting for it with one call of extract_metadata, which splits them into batches of
+    METADATA_BATCH_SIZE files. Files parsed while the request is running are requested together afterwards.
+    '''
+    def request_metadata(self) -> None:
+        while True:
+            with self._lock:
+                waiting, self._metadata_waiting = self._metadata_waiting, []
+                if not waiting:
+                    self._metadata_requesting = False
+                    return
+            jobs = [job for job, _ in waiting]
+            args = (self.model, [job.filename for job in jobs], {job.filename: job.header for job in jobs},
+                    {job.filename: job.info_text for job in jobs})
+            error = None
+            try:
+                if asyncio.iscoroutinefunction(self.model.complete):
+                    metadata = asyncio.run_coroutine_threadsafe(extract_metadata_async(*args), BlockingLLM.background_loop()).result()
+                else:
+                    metadata = extract_metadata(*args)
+            except Exception as e:
+                metadata, error = {}, e
+            for job, stages in waiting:
+                job.metadata = metadata.get(job.filename)
+                if job.metadata is None:
+                    self.fail(job, error or ValueError("the metadata request failed or its answer was invalid"))
+                    self.finish(job)
+                else:
+                    self._executor.submit(self.run, job, stages)
+
+    def metadata(self, job: IngestionJob) -> None:
+        data_cache.put(job.filename, job.path, None, job.metadata, checksum=job.checksum)
+
+    def index(self, job: IngestionJob) -> None:
+        if os.path.getsize(job.path) <= INGESTION_WARM_MAX_MB * 1024 * 1024:
+            warm_sidecar(job.filename, job.metadata)
+
+    def progress(self, jobs: list = None) -> str:
+        jobs = self.jobs if jobs is None else jobs
+        done = sum(job.done for job in jobs)
+        lines = [f"Ingested {done} of {len(jobs)} files"] + [f"- {job.describe()}" for job in jobs]
+        return "\n".join(lines)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
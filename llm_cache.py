@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import asyncio
+from collections import OrderedDict
+
+LLM_CACHE = os.getenv("LLM_CACHE", "true").lower() == "true"
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024")) # answers kept in memory
+LLM_CACHE_DISK = os.getenv("LLM_CACHE_DISK", "true").lower() == "true"
+LLM_CACHE_TTL_DAYS = float(os.getenv("LLM_CACHE_TTL_DAYS", "7"))
+
+
+def cache_key(model_name: str, messages: list, params: dict) -> str:
+    payload = json.dumps({"model": model_name, "messages": messages, "params": params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def default_cache_path() -> str:
+    from sidecar_cache import CACHE_DIR # imported on first use, sidecar_cache imports pandas
+    return os.path.join(CACHE_DIR, "llm_responses.sqlite")
+
+def is_deterministic(params: dict) -> bool:
+    # only answers that would be the same on every request are cached
+    return params.get("temperature") == 0 or params.get("do_sample") is False
+
+
+'''
+Content-addressed cache of LLM answers, keyed by the hash of model name, messages and generation parameters.
+Answers are kept in an in-memory LRU and optionally in a SQLite database (in the GEDA_CACHE_DIR directory),
+so repeated prompts do not need another LLM request, also after a restart. Entries on disk expire after ttl_seconds.
+'''
+class ResponseCache():
+    def __init__(self, max_entries: int = LLM_CACHE_MAX_ENTRIES, disk: bool = True, path: str = None, ttl_seconds: float = None):
+        self.max_entries = max_entries
+        self.disk = disk
+        self.path = path # default_cache_path() if not given
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            self.path = self.path or default_cache_path()
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            connection.commit()
+            self._local.connection = connection
+        return connection
+
+    def get(self, key: str) -> str:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return self._entries[key]
+
+        if self.disk:
+            row = self._connection().execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and not (self.ttl_seconds and time.time() - row[1] > self.ttl_seconds):
+                self._remember(key, row[0])
+                with self._lock:
+                    self.disk_hits += 1
+                return row[0]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, response: str) -> None:
+        self._remember(key, response)
+        if self.disk:
+            connection = self._connection()
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, created_at) VALUES (?, ?, ?)", (key, response, time.time())
+                )
+
+    def _remember(self, key: str, response: str) -> None:
+        with self._lock:
+            self._entries[key] = response
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.disk:
+            connection = self._connection()
+            with connection:
+                connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        if self.disk:
+            connection = self._connection()
+            with connection:
+                connection.execute("DELETE FROM responses")
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            requests = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                "hit_rate": hits / requests if requests else 0.0,
+            }
+
+
+'''
+Caching decorator for a wrapper of the llm_factory. complete() is cached with the completion parameters of the wrapper,
+stream() with its chat parameters; answers of non-deterministic parameters (e.g. temperature 0.7) are never cached.
+A cached answer is streamed as a single delta. Callers that can not parse an answer of complete() discard it
+(see discard_answer), otherwise the same invalid answer would be returned for every retry.
+'''
+class CachedLLM():
+    def __init__(self, wrapper, cache: ResponseCache):
+        self.wrapper = wrapper
+        self.cache = cache
+
+    def __call__(self, history: list):
+        return self.stream(history)
+
+    def key(self, history: list, params: dict) -> str:
+        if not is_deterministic(params):
+            return None
+        return cache_key(self.wrapper.model_name, history, params)
+
+    def stream(self, history: list):
+        key = self.key(history, self.wrapper.chat_params)
+        response = self.cache.get(key) if key else None
+        if response is not None:
+            yield response
+            return
+        deltas = []
+        for delta in self.wrapper.stream(history):
+            deltas.append(delta)
+            yield delta
+        if key:
+            self.cache.put(key, "".join(deltas)) # only complete answers are cached
+
+    def complete(self, history: list) -> str:
+        key = self.key(history, self.wrapper.completion_params)
+        response = self.cache.get(key) if key else None
+        if response is None:
+            response = self.wrapper.complete(history)
+            if key:
+                self.cache.put(key, response)
+        return response
+
+    def discard(self, history: list) -> None:
+        key = self.key(history, self.wrapper.completion_params)
+        if key:
+            self.cache.delete(key)
+
+class AsyncCachedLLM(CachedLLM):
+    async def stream(self, history: list):
+        key = self.key(history, self.wrapper.chat_params)
+        response = self.cache.get(key) if key else None
+        if response is not None:
+            yield response
+            return
+        deltas = []
+        async for delta in self.wrapper.stream(history):
+            deltas.append(delta)
+            yield delta
+        if key:
+            self.cache.put(key, "".join(deltas))
+
+    async def complete(self, history: list) -> str:
+        key = self.key(history, self.wrapper.completion_params)
+        response = self.cache.get(key) if key else None
+        if response is None:
+            response = await self.wrapper.complete(history)
+            if key:
+                self.cache.put(key, response)
+        return response
+
+
+response_cache = ResponseCache(
+    disk=LLM_CACHE_DISK,
+    ttl_seconds=LLM_CACHE_TTL_DAYS * 24 * 60 * 60 if LLM_CACHE_TTL_DAYS > 0 else None,
+)
+
+def discard_answer(model, history: list) -> None:
+    # removes the cached answer of model.complete(history), models without a cache have nothing to discard
+    discard = getattr(model, "discard", None)
+    if discard is not None:
+        discard(history)
+
+def cached_llm(wrapper, cache: ResponseCache = None):
+    cache = cache or response_cache
+    if asyncio.iscoroutinefunction(wrapper.complete):
+        return AsyncCachedLLM(wrapper, cache)
+    return CachedLLM(wrapper, cache)
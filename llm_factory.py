@@ -1,101 +1,500 @@
 import os
+import sys
 import time
-from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
-from dotenv import load_dotenv
-import ollama
-from openai import OpenAI, AzureOpenAI
+import random
+import asyncio
+import importlib
+import subprocess
+import threading
+import weakref
+from llm_cache import LLM_CACHE, cached_llm, discard_answer
 
-load_dotenv()
+'''
+The backends are only imported when a model using them is created or used, so picking a model does not pay
+for the import of the other backends (e.g. transformers takes seconds to import). See backend_import_report.
+'''
+BACKENDS = ["transformers", "ollama", "openai", "httpx", "dotenv"]
 
+def backend(name: str):
+    return importlib.import_module(name) # imported once, then taken from sys.modules
+
+_environment_loaded = False
+
+def load_environment() -> None:
+    # load the .env file once before the first model is created
+    global _environment_loaded
+    if not _environment_loaded:
+        _environment_loaded = True
+        try:
+            backend("dotenv").load_dotenv()
+        except ImportError:
+            pass
+
+# connection pool and retries of the async wrappers, read when they are used so they can be set in the .env file
+def llm_setting(name: str, default: str) -> float:
+    return float(os.getenv(name, default))
+
+'''
+All wrappers generate the answer incrementally: stream(history) yields the text deltas as soon as the model produces them,
+complete(history) returns the full answer. Calling a wrapper streams, so answers can be shown while they are generated.
+Chat answers are generated with chat_params, complete() is used for prompts with structured answers (function selection,
+metadata) and generates deterministically with completion_params, so its answers can be cached (see llm_cache.py).
+'''
 class Phi3Wrapper:
     def __init__(self, model_name: str):
-        self.model = AutoModelForCausalLM.from_pretrained(
-            model_name,
-            device_map="cuda",
-            torch_dtype="auto",
-            trust_remote_code=True,
-        )
-        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model_name = model_name
         self.generation_args = {
             "max_new_tokens": 500,
             "return_full_text": False,
             "temperature": 1.0,
             "do_sample": False,
         }
-        self.pipe = pipeline(
-            "text-generation",
-            model=self.model,
-            tokenizer=self.tokenizer,
-        )
+        self.chat_params = self.completion_params = self.generation_args # greedy decoding is deterministic
+        self.model = None # loaded on first use
+        self.tokenizer = None
+        self._pipe = None
+        self._lock = threading.Lock()
+
+    def pipe(self):
+        with self._lock:
+            if self._pipe is None:
+                transformers = backend("transformers")
+                self.model = transformers.AutoModelForCausalLM.from_pretrained(
+                    self.model_name,
+                    device_map="cuda",
+                    torch_dtype="auto",
+                    trust_remote_code=True,
+                )
+                self.tokenizer = transformers.AutoTokenizer.from_pretrained(self.model_name)
+                self._pipe = transformers.pipeline(
+                    "text-generation",
+                    model=self.model,
+                    tokenizer=self.tokenizer,
+                )
+            return self._pipe
 
     def __call__(self, history: list):
-        output = self.pipe(history, **self.generation_args)
+        return self.stream(history)
+
+    def stream(self, history: list):
+        pipe = self.pipe()
+        # the pipeline generates in a thread and passes the decoded tokens to the streamer
+        streamer = backend("transformers").TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        errors = []
+        def generate():
+            try:
+                pipe(history, **self.generation_args, streamer=streamer)
+            except Exception as e:
+                # the streamer is only ended by a finished generation, without it the iteration below never stops
+                errors.append(e)
+                streamer.end()
+        thread = threading.Thread(target=generate)
+        thread.start()
+        try:
+            for text in streamer:
+                if text:
+                    yield text
+        finally:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def complete(self, history: list) -> str:
+        output = self.pipe()(history, **self.generation_args)
         return output[0]["generated_text"]
 
 class OllamaWrapper:
     def __init__(self, model_name: str):
-        self.model = model_name
-        self.client = ollama.Client()
+        self.model = self.model_name = model_name
+        self.chat_params = {} # default options of the model
+        self.completion_params = {"temperature": 0}
+        self._client = None # created on first use
+
+    def client(self):
+        if self._client is None:
+            self._client = backend("ollama").Client()
+        return self._client
 
     def __call__(self, history: list):
+        return self.stream(history)
+
+    def stream(self, history: list):
+        try:
+            for chunk in self.client().chat(model=self.model, messages=history, stream=True):
+                content = chunk['message']['content']
+                if content:
+                    yield content
+        except Exception as e:
+            raise ValueError(f"Ollama error: {str(e)}")
+
+    def complete(self, history: list) -> str:
         try:
-            response = self.client.chat(model=self.model, messages=history)
+            response = self.client().chat(model=self.model, messages=history, options=self.completion_params)
             return response['message']['content']
         except Exception as e:
             raise ValueError(f"Ollama error: {str(e)}")
 
 class OpenAIWrapper:
+    error_name = "OpenAI"
+
     def __init__(self, model_name: str = "gpt-4o-mini"):
-        self.model = model_name
-        self.client = OpenAI(
+        self.model = self.model_name = model_name
+        self.chat_params = {"temperature": 0.7}
+        self.completion_params = {"temperature": 0}
+        self._client = None # created on first use
+
+    def client(self):
+        if self._client is None:
+            self._client = self.create_client()
+        return self._client
+
+    def create_client(self):
+        return backend("openai").OpenAI(
             api_key=os.getenv("OPENAI_API_KEY", ""),
             base_url=os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
         )
 
     def __call__(self, history: list):
+        return self.stream(history)
+
+    def stream(self, history: list):
+        try:
+            response = self.client().chat.completions.create(
+                model=self.model,
+                messages=history,
+                stream=True,
+                **self.chat_params,
+            )
+            for chunk in response:
+                # Azure sends chunks without choices (e.g. content filter results)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            raise ValueError(f"{self.error_name} error: {str(e)}")
+
+    def complete(self, history: list) -> str:
         try:
-            response = self.client.chat.completions.create(
+            response = self.client().chat.completions.create(
                 model=self.model,
                 messages=history,
-                temperature=0.7,
+                **self.completion_params,
             )
             return response.choices[0].message.content
         except Exception as e:
-            raise ValueError(f"OpenAI error: {str(e)}")
+            raise ValueError(f"{self.error_name} error: {str(e)}")
 
-class AzureOpenAIWrapper:
-    def __init__(self, model_name: str = "gpt-4o-mini"):
-        self.model = model_name
-        self.client = AzureOpenAI(
+class AzureOpenAIWrapper(OpenAIWrapper):
+    error_name = "Azure OpenAI"
+
+    def create_client(self):
+        return backend("openai").AzureOpenAI(
             azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT", ""),
             api_key=os.getenv("AZURE_OPENAI_API_KEY"),
             api_version="2024-02-01",
         )
 
+
+'''
+Async wrappers, a completion only waits on the event loop instead of blocking a thread for its whole duration.
+They have the same interface as the synchronous wrappers: stream(history) is an async generator of text deltas,
+complete(history) a coroutine returning the full answer. All wrappers share one keep-alive connection pool per event loop
+(connections can not be used across event loops), failed requests are retried with jittered exponential backoff.
+'''
+_transports = weakref.WeakKeyDictionary() # event loop -> pooled transport
+
+def shared_transport():
+    loop = asyncio.get_running_loop()
+    transport = _transports.get(loop)
+    if transport is None:
+        httpx = backend("httpx")
+        pool_size = int(llm_setting("LLM_POOL_SIZE", "20")) # connections kept open per event loop
+        transport = httpx.AsyncHTTPTransport(limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size))
+        _transports[loop] = transport
+    return transport
+
+def http_timeout():
+    # seconds to wait for a response (or the next streamed chunk) and to connect
+    return backend("httpx").Timeout(llm_setting("LLM_TIMEOUT", "120"), connect=llm_setting("LLM_CONNECT_TIMEOUT", "10"))
+
+def is_retryable(e: Exception) -> bool:
+    status_code = getattr(e, "status_code", None) # openai.APIStatusError and ollama.ResponseError
+    if status_code is not None:
+        return status_code == 429 or status_code >= 500
+    # connection errors and timeouts, only the backends in use are imported
+    transient = []
+    if "httpx" in sys.modules:
+        transient.append(sys.modules["httpx"].TransportError)
+    if "openai" in sys.modules:
+        transient.append(sys.modules["openai"].APIConnectionError)
+    return isinstance(e, tuple(transient))
+
+def max_retries() -> int:
+    return int(llm_setting("LLM_MAX_RETRIES", "3"))
+
+def retry_delay(attempt: int) -> float:
+    # full jitter, so clients failing at the same time do not retry at the same time
+    base_delay = llm_setting("LLM_RETRY_BASE_DELAY", "0.5") # seconds, doubled on every retry
+    return random.uniform(0, min(llm_setting("LLM_RETRY_MAX_DELAY", "10"), base_delay * 2 ** attempt))
+
+class AsyncLLMWrapper:
+    error_name = "LLM"
+
+    def __init__(self, model_name: str):
+        self.model = self.model_name = model_name
+        self.chat_params = {"temperature": 0.7}
+        self.completion_params = {"temperature": 0}
+        self._clients = weakref.WeakKeyDictionary() # event loop -> SDK client using the shared transport
+
+    def client(self):
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self.create_client()
+            self._clients[loop] = client
+        return client
+
     def __call__(self, history: list):
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=history,
-                temperature=0.7,
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            raise ValueError(f"Azure OpenAI error: {str(e)}")
-
-
-def llm_factory(model_name: str):
-    if model_name == "phi3":
-        return Phi3Wrapper("microsoft/Phi-3.5-mini-instruct")
-    elif model_name == "llama3.2":
-        return OllamaWrapper("llama3.2")
-    elif model_name == "QuantTrio/Qwen3-Coder-30B-A3B-Instruct-AWQ":
-        return OpenAIWrapper(model_name)
-    elif model_name == "azure-gpt-4o-mini":
-        return AzureOpenAIWrapper("gpt-4o-mini")
-    else:
+        return self.stream(history)
+
+    async def stream(self, history: list):
+        attempt = 0
+        while True:
+            started = False
+            try:
+                async for delta in self.request_stream(history):
+                    started = True
+                    yield delta
+                return
+            except Exception as e:
+                # a stream is only retried if nothing has been yielded yet
+                if started or not is_retryable(e) or attempt >= max_retries():
+                    raise ValueError(f"{self.error_name} error: {str(e)}")
+            await asyncio.sleep(retry_delay(attempt))
+            attempt += 1
+
+    async def complete(self, history: list) -> str:
+        attempt = 0
+        while True:
+            try:
+                return await self.request(history)
+            except Exception as e:
+                if not is_retryable(e) or attempt >= max_retries():
+                    raise ValueError(f"{self.error_name} error: {str(e)}")
+            await asyncio.sleep(retry_delay(attempt))
+            attempt += 1
+
+class AsyncOllamaWrapper(AsyncLLMWrapper):
+    error_name = "Ollama"
+
+    def __init__(self, model_name: str):
+        super().__init__(model_name)
+        self.chat_params = {} # default options of the model
+
+    def create_client(self):
+        return backend("ollama").AsyncClient(transport=shared_transport(), timeout=http_timeout())
+
+    async def request_stream(self, history: list):
+        async for chunk in await self.client().chat(model=self.model, messages=history, stream=True):
+            content = chunk['message']['content']
+            if content:
+                yield content
+
+    async def request(self, history: list) -> str:
+        response = await self.client().chat(model=self.model, messages=history, options=self.completion_params)
+        return response['message']['content']
+
+class AsyncOpenAIWrapper(AsyncLLMWrapper):
+    error_name = "OpenAI"
+
+    def create_client(self):
+        return backend("openai").AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY", ""),
+            base_url=os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1"),
+            http_client=backend("httpx").AsyncClient(transport=shared_transport(), timeout=http_timeout()),
+            max_retries=0, # retried by the wrapper
+        )
+
+    async def request_stream(self, history: list):
+        response = await self.client().chat.completions.create(
+            model=self.model,
+            messages=history,
+            stream=True,
+            **self.chat_params,
+        )
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def request(self, history: list) -> str:
+        response = await self.client().chat.completions.create(
+            model=self.model,
+            messages=history,
+            **self.completion_params,
+        )
+        return response.choices[0].message.content
+
+class AsyncAzureOpenAIWrapper(AsyncOpenAIWrapper):
+    error_name = "Azure OpenAI"
+
+    def create_client(self):
+        return backend("openai").AsyncAzureOpenAI(
+            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT", ""),
+            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+            api_version="2024-02-01",
+            http_client=backend("httpx").AsyncClient(transport=shared_transport(), timeout=http_timeout()),
+            max_retries=0,
+        )
+
+'''
+Async interface for a synchronous wrapper (the local Phi3 model), generation runs in a worker thread.
+'''
+class AsyncThreadWrapper:
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+        self.model_name = wrapper.model_name
+        self.chat_params = wrapper.chat_params
+        self.completion_params = wrapper.completion_params
+
+    def __call__(self, history: list):
+        return self.stream(history)
+
+    async def stream(self, history: list):
+        iterator = self.wrapper.stream(history)
+        while True:
+            delta = await asyncio.to_thread(next, iterator, None)
+            if delta is None:
+                return
+            yield delta
+
+    async def complete(self, history: list) -> str:
+        return await asyncio.to_thread(self.wrapper.complete, history)
+
+'''
+Synchronous interface for an async wrapper, for code running in threads (e.g. the functions and the ingestion queue).
+The requests run on the given event loop, by default on a background event loop shared by all blocking wrappers.
+'''
+class BlockingLLM:
+    _loop = None
+    _loop_lock = threading.Lock()
+
+    def __init__(self, wrapper, loop: asyncio.AbstractEventLoop = None):
+        self.wrapper = wrapper
+        self.loop = loop
+
+    @classmethod
+    def background_loop(cls) -> asyncio.AbstractEventLoop:
+        with cls._loop_lock:
+            if cls._loop is None:
+                cls._loop = asyncio.new_event_loop()
+                threading.Thread(target=cls._loop.run_forever, name="llm-event-loop", daemon=True).start()
+            return cls._loop
+
+    def __call__(self, history: list):
+        return self.stream(history)
+
+    def stream(self, history: list):
+        yield self.complete(history) # the functions only need the full answer
+
+    def complete(self, history: list) -> str:
+        future = asyncio.run_coroutine_threadsafe(self.wrapper.complete(history), self.loop or self.background_loop())
+        return future.result()
+
+    def discard(self, history: list) -> None:
+        discard_answer(self.wrapper, history)
+
+
+# model name -> backends, wrapper and async wrapper of the model, the wrappers import their backend on first use
+MODELS = {
+    "phi3": {
+        "backends": ["transformers"],
+        "wrapper": lambda: Phi3Wrapper("microsoft/Phi-3.5-mini-instruct"),
+        "async_wrapper": lambda: AsyncThreadWrapper(Phi3Wrapper("microsoft/Phi-3.5-mini-instruct")),
+    },
+    "llama3.2": {
+        "backends": ["ollama"],
+        "wrapper": lambda: OllamaWrapper("llama3.2"),
+        "async_wrapper": lambda: AsyncOllamaWrapper("llama3.2"),
+    },
+    "QuantTrio/Qwen3-Coder-30B-A3B-Instruct-AWQ": {
+        "backends": ["openai"],
+        "wrapper": lambda: OpenAIWrapper("QuantTrio/Qwen3-Coder-30B-A3B-Instruct-AWQ"),
+        "async_wrapper": lambda: AsyncOpenAIWrapper("QuantTrio/Qwen3-Coder-30B-A3B-Instruct-AWQ"),
+    },
+    "azure-gpt-4o-mini": {
+        "backends": ["openai"],
+        "wrapper": lambda: AzureOpenAIWrapper("gpt-4o-mini"),
+        "async_wrapper": lambda: AsyncAzureOpenAIWrapper("gpt-4o-mini"),
+    },
+}
+
+def model_spec(model_name: str) -> dict:
+    if model_name not in MODELS:
         raise ValueError(f"Model {model_name} not supported")
+    return MODELS[model_name]
+
+'''
+Create the wrapper of a model, the answers are cached unless cache is False (see llm_cache.py)
+'''
+def llm_factory(model_name: str, cache: bool = LLM_CACHE):
+    load_environment()
+    llm = model_spec(model_name)["wrapper"]()
+    return cached_llm(llm) if cache else llm
+
+def async_llm_factory(model_name: str, cache: bool = LLM_CACHE):
+    load_environment()
+    llm = model_spec(model_name)["async_wrapper"]()
+    return cached_llm(llm) if cache else llm
+
+# measures the import of a backend in a fresh interpreter, the resident memory is read from /proc where available
+# (the peak RSS of ru_maxrss is inherited from the parent process on Linux)
+IMPORT_REPORT_CODE = """
+import os, sys, time
+def rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+before = rss()
+start = time.perf_counter()
+import {backend}
+print(time.perf_counter() - start, rss() - before)
+"""
+
+'''
+Cold import time and memory of every backend, each measured in a fresh interpreter so modules imported before do not hide the cost
+'''
+def backend_import_report(backends: list = None) -> list:
+    report = []
+    for name in backends or BACKENDS:
+        models = [model for model, spec in MODELS.items() if name in spec["backends"]]
+        result = subprocess.run([sys.executable, "-c", IMPORT_REPORT_CODE.format(backend=name)], capture_output=True, text=True)
+        if result.returncode != 0:
+            report.append({"backend": name, "models": models, "installed": False, "seconds": None, "memory_mb": None})
+            continue
+        seconds, memory = result.stdout.split()[-2:]
+        report.append({"backend": name, "models": models, "installed": True, "seconds": float(seconds), "memory_mb": int(memory) / 2**20})
+    return report
+
+def print_import_report(backends: list = None) -> None:
+    print(f"{'backend':<14} {'import (s)':>10} {'memory (MB)':>12}  models")
+    for row in backend_import_report(backends):
+        if row["installed"]:
+            print(f"{row['backend']:<14} {row['seconds']:>10.2f} {row['memory_mb']:>12.1f}  {', '.join(row['models']) or '-'}")
+        else:
+            print(f"{row['backend']:<14} {'not installed':>23}  {', '.join(row['models']) or '-'}")
 
 if __name__ == "__main__":
-    llm = llm_factory(os.getenv("MODEL_NAME", ""))
-    print(f"Model in use: {os.getenv('MODEL_NAME', '')}")
+    import argparse
+    parser = argparse.ArgumentParser(description="Create the model set in MODEL_NAME or report the import cost of the LLM backends.")
+    parser.add_argument("--import-report", action="store_true", help="show the import time and memory of every backend")
+    args = parser.parse_args()
+
+    if args.import_report:
+        print_import_report()
+    else:
+        load_environment()
+        llm = llm_factory(os.getenv("MODEL_NAME", ""))
+        print(f"Model in use: {os.getenv('MODEL_NAME', '')}")
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+from data_cache import data_cache, LazyDataFrames
+from data_loader import ColumnType, MetadataType, lowercase_categories
+
+
+def normalize_name(name) -> str:
+    return str(name).lower()
+
+def value_positions(column: pd.Series) -> dict:
+    # normalized value -> sorted row positions, only the distinct values are lowercased
+    keys = lowercase_categories(column)
+    return pd.Series(np.arange(len(keys))).groupby(keys, observed=True).indices
+
+'''
+Inverted index from normalized material and supplier names to the row positions in the cached files,
+the columns are taken from the ColumnType mapping in the metadata.
+Looking up a material is a dictionary access per file instead of a case-insensitive scan of every row.
+A file is indexed the first time it is looked up, so only the data frames of queried files are loaded.
+'''
+class LookupIndex():
+    def __init__(self, metadata: dict, data_frames: LazyDataFrames):
+        self.metadata = metadata
+        self.data_frames = data_frames
+        self.files = {} # file -> {column type: {name: row positions}}
+
+    def file_index(self, file: str) -> dict:
+        if file not in self.files:
+            columns = self.metadata[file][MetadataType.COLUMNS]
+            df = self.data_frames[file]
+            self.files[file] = {
+                column_type: value_positions(df[columns[column_type]])
+                for column_type in [ColumnType.MATERIAL, ColumnType.SUPPLIER] if column_type in columns
+            }
+        return self.files[file]
+
+    def rows(self, column_type: str, name: str, files: list) -> dict:
+        self.data_frames.preload([f for f in files if f not in self.files])
+        name = normalize_name(name)
+        rows = {}
+        for file in files:
+            positions = self.file_index(file).get(column_type, {}).get(name)
+            if positions is not None:
+                rows[file] = positions
+        return rows
+
+    def rows_by_material(self, material: str, files: list) -> dict:
+        return self.rows(ColumnType.MATERIAL, material, files)
+
+    def rows_by_supplier(self, supplier: str, files: list) -> dict:
+        return self.rows(ColumnType.SUPPLIER, supplier, files)
+
+'''
+Get the lookup index of the files returned by get_data, the files are indexed when they are looked up
+'''
+def get_lookup_index(metadata: dict, data_frames: LazyDataFrames) -> LookupIndex:
+    return data_cache.derived(
+        "lookup_index", lambda files, metadata, data_frames: LookupIndex(metadata, data_frames), metadata, data_frames
+    )
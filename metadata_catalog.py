@@ -0,0 +1,78 @@
+from bisect import bisect_right
+from data_cache import data_cache
+from data_loader import MetadataType
+
+'''
+Catalog of the metadata of all cached files, used by the functions to select their data sources.
+Files are indexed by type, country code, available columns, first year and year interval,
+the intervals are kept sorted by their start so only files starting before a year are checked.
+'''
+class MetadataCatalog():
+    def __init__(self, metadata: dict):
+        self.by_type = {}
+        self.by_country = {}
+        self.by_column = {}
+        self.by_year_from = {}
+        self.year_intervals = [] # (year_from, year_to, file) sorted by year_from
+        for file, mt in metadata.items():
+            self.add(file, mt)
+        self.year_intervals.sort(key=lambda interval: interval[0])
+        self.year_starts = [interval[0] for interval in self.year_intervals]
+
+    def add(self, file: str, mt: dict) -> None:
+        self.by_type.setdefault(str(mt[MetadataType.TYPE]).lower(), set()).add(file)
+        self.by_country.setdefault(mt[MetadataType.COUNTRY_CODE], set()).add(file)
+        for column_type in mt[MetadataType.COLUMNS].keys():
+            self.by_column.setdefault(column_type, set()).add(file)
+        self.by_year_from.setdefault(str(mt[MetadataType.YEAR_FROM]), set()).add(file)
+        try:
+            self.year_intervals.append((int(mt[MetadataType.YEAR_FROM]), int(mt[MetadataType.YEAR_TO]), file))
+        except (TypeError, ValueError):
+            pass # year_from or year_to is "unknown"
+
+    def covering(self, year) -> set:
+        try:
+            year = int(year)
+        except (TypeError, ValueError):
+            return set()
+        end = bisect_right(self.year_starts, year)
+        return {file for _, year_to, file in self.year_intervals[:end] if year <= year_to}
+
+    '''
+    Select the files matching all given criteria, in the order of files:
+    - data_type: type of the file (case-insensitive)
+    - countries: accepted country codes, None accepts every country
+    - columns: column types that all have to be available
+    - any_columns: column types of which at least one has to be available
+    - year: year that has to be covered by the years of the file
+    - year_from: first year of the file
+    '''
+    def select(self, files: list, data_type: str = None, countries: list = None, columns: list = (),
+               any_columns: list = (), year=None, year_from=None) -> list:
+        candidates = [set(files)]
+        if data_type is not None:
+            candidates.append(self.by_type.get(data_type.lower(), set()))
+        if countries is not None:
+            candidates.append(set().union(*[self.by_country.get(country, set()) for country in countries]))
+        for column_type in columns:
+            candidates.append(self.by_column.get(column_type, set()))
+        if any_columns:
+            candidates.append(set().union(*[self.by_column.get(column_type, set()) for column_type in any_columns]))
+        if year is not None:
+            candidates.append(self.covering(year))
+        if year_from is not None:
+            candidates.append(self.by_year_from.get(str(year_from), set()))
+
+        selected = set.intersection(*sorted(candidates, key=len))
+        return [file for file in files if file in selected]
+
+
+def countries_or_global(country_code: str) -> list:
+    # files of the country and global files, every file for "global"
+    return None if country_code == "global" else [country_code, "global"]
+
+'''
+Get the catalog of the metadata returned by get_data
+'''
+def get_catalog(metadata: dict) -> MetadataCatalog:
+    return data_cache.derived("metadata_catalog", lambda files, metadata, data_frames: MetadataCatalog(metadata), metadata, None)
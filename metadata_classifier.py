@@ -0,0 +1,183 @@
+import os
+import re
+import difflib
+import numpy as np
+import pandas as pd
+from data_loader import ColumnType
+
+'''
+Deterministic metadata extraction for files following the known naming and header conventions,
+e.g. "Sales data_US_2023.xlsx" or "Material Cost_global_2018-2022.xlsx".
+Every extracted value gets a confidence, the LLM is only asked if the lowest confidence is below the threshold.
+'''
+
+CLASSIFIER_THRESHOLD = float(os.getenv("METADATA_CLASSIFIER_THRESHOLD", "0.8"))
+
+FILENAME_PATTERN = re.compile(r"^(?P<name>.+?)_(?P<country>[A-Za-z]+)_(?P<year_from>\d{4})(?:-(?P<year_to>\d{4}))?\.\w+$")
+
+TYPE_KEYWORDS = [
+    ("sales", ["sales", "umsatz", "verkauf"]),
+    ("inventory", ["inventory", "storage", "stock", "lager"]),
+    ("costs_per_unit", ["cost", "kosten"]),
+]
+
+COUNTRY_CODES = {
+    "ch": "CH", "de": "DE", "d": "DE", "fr": "FR", "f": "FR", "es": "ES", "e": "ES", "us": "US", "usa": "US", "global": "global",
+}
+
+COUNTRY_NAMES = {
+    "switzerland": "CH", "germany": "DE", "france": "FR", "spain": "ES", "united states": "US", "usa": "US", "global": "global",
+}
+
+CURRENCIES = {"$": "dollar", "usd": "dollar", "dollar": "dollar", "€": "euro", "eur": "euro", "euro": "euro"}
+
+# column names without currency or unit, mapped to a column type ("{currency}" is replaced by dollar or euro)
+COLUMN_SYNONYMS = {
+    "supplier": ColumnType.SUPPLIER, "lieferant": ColumnType.SUPPLIER, "vendor": ColumnType.SUPPLIER,
+    "material": ColumnType.MATERIAL,
+    "cost per unit": "cost_per_unit_{currency}", "unit cost": "cost_per_unit_{currency}", "kosten pro einheit": "cost_per_unit_{currency}",
+    "lead time": ColumnType.LEAD_TIME_DAYS, "lieferzeit": ColumnType.LEAD_TIME_DAYS,
+    "price": "price_{currency}", "preis": "price_{currency}",
+    "units in storage": ColumnType.UNITS_IN_STORAGE, "stock": ColumnType.UNITS_IN_STORAGE, "lagerbestand": ColumnType.UNITS_IN_STORAGE,
+    "year": ColumnType.YEAR, "jahr": ColumnType.YEAR,
+    "month": ColumnType.MONTH, "monat": ColumnType.MONTH,
+    "units sold": ColumnType.UNITS_SOLD, "verkaufte einheiten": ColumnType.UNITS_SOLD, "quantity sold": ColumnType.UNITS_SOLD,
+    "total sales": "total_sales_{currency}", "sales": "total_sales_{currency}", "umsatz": "total_sales_{currency}", "revenue": "total_sales_{currency}",
+}
+
+# descriptions of the column types for the embedding based matching
+COLUMN_DESCRIPTIONS = {
+    ColumnType.SUPPLIER: "supplier name",
+    ColumnType.MATERIAL: "material name",
+    ColumnType.COST_PER_UNIT_DOLLAR: "cost per unit in dollar",
+    ColumnType.LEAD_TIME_DAYS: "lead time in days",
+    ColumnType.PRICE_DOLLAR: "price in dollar",
+    ColumnType.UNITS_IN_STORAGE: "units in storage",
+    ColumnType.YEAR: "year",
+    ColumnType.MONTH: "month",
+    ColumnType.UNITS_SOLD: "number of units sold",
+    ColumnType.TOTAL_SALES_DOLLAR: "total sales in dollar",
+    ColumnType.TOTAL_SALES_EURO: "total sales in euro",
+}
+
+EMBEDDING_THRESHOLD = 0.75
+_description_embeddings = None
+
+
+def split_column_name(column: str) -> (str, str):
+    # "Total Sales ($)" -> ("total sales", "dollar"), "Lead Time (Days)" -> ("lead time", None)
+    name = str(column).lower()
+    currency = None
+    for symbol, value in CURRENCIES.items():
+        if re.search(r"(^|[\s(]){}($|[\s)])".format(re.escape(symbol)), name):
+            currency = value
+    base = re.sub(r"\(.*?\)", " ", name)
+    base = re.sub(r"[^\w\s]", " ", base)
+    base = re.sub(r"\s+", " ", base).strip()
+    return base, currency
+
+def embed(texts: list) -> np.ndarray:
+    # reuse the sentence encoder of the function calling agent, matching by embeddings is skipped if it is not available
+    try:
+        from function_calling_agent import encoder
+        model = encoder()
+    except Exception as e:
+        print(f"Sentence encoder not available for metadata classification: {e}")
+        return None
+    return np.array(model.encode(texts, normalize_embeddings=True)).astype('float32')
+
+def match_column_by_embedding(base: str) -> (str, float):
+    global _description_embeddings
+    if _description_embeddings is None:
+        embeddings = embed(list(COLUMN_DESCRIPTIONS.values()))
+        _description_embeddings = embeddings if embeddings is not None else False
+    if _description_embeddings is False:
+        return None, 0.0
+    column_embedding = embed([base])
+    if column_embedding is None:
+        return None, 0.0
+    similarities = _description_embeddings @ column_embedding[0]
+    best = int(np.argmax(similarities))
+    return list(COLUMN_DESCRIPTIONS.keys())[best], float(similarities[best])
+
+def classify_column(column: str) -> (str, float):
+    base, currency = split_column_name(column)
+    column_type, confidence = None, 0.0
+    if base in COLUMN_SYNONYMS:
+        column_type, confidence = COLUMN_SYNONYMS[base], 1.0
+    else:
+        close_matches = difflib.get_close_matches(base, COLUMN_SYNONYMS.keys(), n=1, cutoff=0.85) # e.g. typos
+        if close_matches:
+            column_type = COLUMN_SYNONYMS[close_matches[0]]
+            confidence = difflib.SequenceMatcher(None, base, close_matches[0]).ratio()
+        else:
+            column_type, confidence = match_column_by_embedding(base)
+            if confidence < EMBEDDING_THRESHOLD:
+                return None, confidence
+
+    if "{currency}" in column_type:
+        if currency is None:
+            currency, confidence = "dollar", min(confidence, 0.7)
+        column_type = column_type.format(currency=currency)
+    if column_type not in COLUMN_DESCRIPTIONS:
+        return None, 0.0 # e.g. cost per unit in euro
+    return column_type, confidence
+
+def classify_type(name: str) -> (str, float):
+    name = name.lower()
+    for data_type, keywords in TYPE_KEYWORDS:
+        if any(keyword in name for keyword in keywords):
+            return data_type, 1.0
+    return None, 0.0
+
+def classify_country(country: str, info_text: str) -> (str, float):
+    if country and country.lower() in COUNTRY_CODES:
+        return COUNTRY_CODES[country.lower()], 1.0
+    found = {code for name, code in COUNTRY_NAMES.items() if re.search(r"\b{}\b".format(name), info_text.lower())}
+    if len(found) == 1:
+        return found.pop(), 0.9
+    return "global", 0.5
+
+'''
+Classify a file by its name, info text and columns.
+Returns the metadata in the same format as the LLM based extraction and the confidence of the classification.
+'''
+def classify_metadata(filename: str, df: pd.DataFrame, info_text: str) -> (dict, float):
+    confidences = []
+    match = FILENAME_PATTERN.match(filename)
+    name = match.group("name") if match else os.path.splitext(filename)[0]
+
+    data_type, confidence = classify_type(name)
+    confidences.append(confidence)
+
+    country_code, confidence = classify_country(match.group("country") if match else None, info_text)
+    confidences.append(confidence)
+
+    columns = {}
+    for column in df.columns:
+        column_type, confidence = classify_column(column)
+        if column_type is None or column_type in columns:
+            confidences.append(0.0) # unknown or ambiguous column
+            continue
+        columns[column_type] = column
+        confidences.append(confidence)
+
+    if match:
+        year_from = int(match.group("year_from"))
+        year_to = int(match.group("year_to") or year_from)
+    elif ColumnType.YEAR in columns:
+        years = pd.to_numeric(df[columns[ColumnType.YEAR]], errors="coerce").dropna()
+        year_from, year_to = (int(years.min()), int(years.max())) if len(years) > 0 else ("unknown", "unknown")
+        confidences.append(0.9 if len(years) > 0 else 0.0)
+    else:
+        year_from, year_to = "unknown", "unknown"
+        confidences.append(0.0)
+
+    metadata = {
+        "type": data_type,
+        "country_code": country_code,
+        "year_from": year_from,
+        "year_to": year_to,
+        "columns": columns,
+    }
+    return metadata, min(confidences)
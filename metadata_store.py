@@ -0,0 +1,68 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from sidecar_cache import CACHE_DIR
+
+
+'''
+Persistent store of the extracted metadata, keyed by the checksum of the file content and the filename:
+the metadata depends on the filename as well (country and years are taken from it), so a copy of a file saved
+under another name is described again.
+Backed by SQLite in WAL mode, so readers in other threads and processes are never blocked by a writer.
+Entries expire after ttl_seconds; without a TTL a file is classified only once.
+'''
+class MetadataStore():
+    def __init__(self, path: str = os.path.join(CACHE_DIR, "metadata.sqlite"), ttl_seconds: float = None):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS metadata ("
+                "checksum TEXT NOT NULL, filename TEXT NOT NULL, metadata TEXT NOT NULL, created_at REAL NOT NULL, "
+                "PRIMARY KEY (checksum, filename))"
+            )
+            connection.commit()
+            self._local.connection = connection
+        return connection
+
+    def get(self, checksum: str, filename: str) -> dict:
+        row = self._connection().execute(
+            "SELECT metadata, created_at FROM metadata WHERE checksum = ? AND filename = ?", (checksum, filename)
+        ).fetchone()
+        if row is None:
+            return None
+        if self.ttl_seconds and time.time() - row[1] > self.ttl_seconds:
+            self.delete(checksum, filename)
+            return None
+        return json.loads(row[0])
+
+    def put(self, checksum: str, filename: str, metadata: dict) -> None:
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO metadata (checksum, filename, metadata, created_at) VALUES (?, ?, ?, ?)",
+                (checksum, filename, json.dumps(metadata), time.time()),
+            )
+
+    def delete(self, checksum: str, filename: str) -> None:
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM metadata WHERE checksum = ? AND filename = ?", (checksum, filename))
+
+    def clear(self) -> None:
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM metadata")
+
+
+ttl_days = float(os.getenv("METADATA_TTL_DAYS", "0"))
+metadata_store = MetadataStore(ttl_seconds=ttl_days * 24 * 60 * 60 if ttl_days > 0 else None)
@@ -0,0 +1,157 @@
+import os
+import importlib.util
+from datetime import date, time, timedelta
+import numpy as np
+import pandas as pd
+
+'''
+Reader engines for spreadsheet files. Every engine streams the rows of the first sheet as lists of cell values,
+converted the same way the pandas reader with the same engine does, so the grid is parsed identically.
+- openpyxl: pure Python, .xlsx only, streams the sheet row by row
+- calamine: Rust based (python-calamine), .xlsx and legacy .xls, the fastest engine
+- xlrd: legacy .xls only
+With "auto" the fastest installed engine that can read the file is used, EXCEL_READER_ENGINE selects the default.
+Files the selected engine can not read are read with the fastest engine as well.
+'''
+EXCEL_READER_ENGINE = os.getenv("EXCEL_READER_ENGINE", "auto")
+
+
+class ReaderEngine():
+    name = None
+    module = None
+    extensions = ()
+
+    def available(self) -> bool:
+        return importlib.util.find_spec(self.module) is not None
+
+    def can_read(self, file_path: str) -> bool:
+        return os.path.splitext(file_path)[1].lower() in self.extensions
+
+    def iter_rows(self, file_path: str):
+        raise NotImplementedError
+
+
+class OpenpyxlEngine(ReaderEngine):
+    name = "openpyxl"
+    module = "openpyxl"
+    extensions = (".xlsx",)
+
+    def iter_rows(self, file_path: str):
+        from openpyxl import load_workbook
+        from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+
+        def convert_cell(cell):
+            if cell.value is None:
+                return ""
+            elif cell.data_type == TYPE_ERROR:
+                return np.nan
+            elif cell.data_type == TYPE_NUMERIC:
+                val = int(cell.value)
+                if val == cell.value:
+                    return val
+                return float(cell.value)
+            return cell.value
+
+        workbook = load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+        try:
+            sheet = workbook.worksheets[0]
+            sheet.reset_dimensions()
+            for row in sheet.rows:
+                yield [convert_cell(cell) for cell in row]
+        finally:
+            workbook.close()
+
+
+class CalamineEngine(ReaderEngine):
+    name = "calamine"
+    module = "python_calamine"
+    extensions = (".xlsx", ".xls")
+
+    def iter_rows(self, file_path: str):
+        from python_calamine import CalamineWorkbook
+
+        def convert_cell(value):
+            if isinstance(value, float):
+                val = int(value)
+                if val == value:
+                    return val
+                return value
+            elif isinstance(value, date):
+                return pd.Timestamp(value)
+            elif isinstance(value, timedelta):
+                return pd.Timedelta(value)
+            return value
+
+        workbook = CalamineWorkbook.from_path(file_path)
+        try:
+            sheet = workbook.get_sheet_by_index(0)
+            for row in sheet.iter_rows():
+                yield [convert_cell(value) for value in row]
+        finally:
+            workbook.close()
+
+
+class XlrdEngine(ReaderEngine):
+    name = "xlrd"
+    module = "xlrd"
+    extensions = (".xls",)
+
+    def iter_rows(self, file_path: str):
+        import xlrd
+        from xlrd import XL_CELL_BOOLEAN, XL_CELL_DATE, XL_CELL_ERROR, XL_CELL_NUMBER
+
+        workbook = xlrd.open_workbook(file_path, on_demand=True)
+        epoch1904 = workbook.datemode
+
+        def convert_cell(cell):
+            value = cell.value
+            if cell.ctype == XL_CELL_DATE:
+                try:
+                    value = xlrd.xldate.xldate_as_datetime(value, epoch1904)
+                except OverflowError:
+                    return value
+                # Excel does not distinguish between dates and times, dates on the epoch are times only
+                if (not epoch1904 and value.timetuple()[0:3] == (1899, 12, 31)) or (epoch1904 and value.timetuple()[0:3] == (1904, 1, 1)):
+                    value = time(value.hour, value.minute, value.second, value.microsecond)
+                return value
+            elif cell.ctype == XL_CELL_ERROR:
+                return np.nan
+            elif cell.ctype == XL_CELL_BOOLEAN:
+                return bool(value)
+            elif cell.ctype == XL_CELL_NUMBER:
+                if value == int(value):
+                    return int(value)
+            return value
+
+        try:
+            sheet = workbook.sheet_by_index(0)
+            for row_number in range(sheet.nrows):
+                yield [convert_cell(cell) for cell in sheet.row(row_number)]
+        finally:
+            workbook.release_resources()
+
+
+ENGINES = {engine.name: engine for engine in [CalamineEngine(), OpenpyxlEngine(), XlrdEngine()]} # fastest first
+
+def select_engine(file_path: str, name: str = None) -> ReaderEngine:
+    name = name or EXCEL_READER_ENGINE
+    if name != "auto":
+        engine = ENGINES.get(name)
+        if engine is None:
+            raise ValueError(f"Unknown reader engine '{name}', available engines: {', '.join(ENGINES)}.")
+        if engine.can_read(file_path):
+            return engine
+        # e.g. xlrd for .xlsx files, the fastest engine that can read the file is used instead
+
+    for engine in ENGINES.values():
+        if engine.can_read(file_path) and engine.available():
+            return engine
+    extension = os.path.splitext(file_path)[1].lower()
+    packages = ", ".join(e.module for e in ENGINES.values() if extension in e.extensions)
+    raise ValueError(f"No reader engine installed for {extension} files, install one of: {packages}.")
+
+def has_reader_engine(file_path: str) -> bool:
+    return any(engine.can_read(file_path) and engine.available() for engine in ENGINES.values())
+
+def available_engines() -> list:
+    return [name for name, engine in ENGINES.items() if engine.available()]
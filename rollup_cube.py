@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+from data_cache import data_cache, LazyDataFrames
+from data_loader import ColumnType, MetadataType
+from fact_table import get_sales_facts
+
+'''
+Pre-aggregated sales and cost data of all cached files, so the monthly and quarterly functions do not group raw rows on every call.
+- sales: units sold and sales per file, year, month and material, rolled up to all materials and to quarters and years
+- costs: sum and count of every numeric column of the cost files per year and quarter, for averages per quarter
+A file is only answered from the cube if all of its rows have a valid year and month, otherwise the functions use the raw data.
+'''
+class RollupCube():
+    def __init__(self, facts: pd.DataFrame, cost_frames: dict):
+        facts = facts.assign(quarter=(facts["month"] - 1) // 3 + 1)
+        values = ["units_sold", "sales"]
+        self.by_material = facts.groupby(["file", "year", "month", "material"], observed=True)[values].sum()
+        self.by_month = facts.groupby(["file", "year", "month"], observed=True)[values].sum()
+        self.by_quarter = facts.groupby(["file", "year", "quarter"], observed=True)[values].sum()
+        self.by_year = facts.groupby(["file", "year"], observed=True)[values].sum()
+
+        # files with rows that are missing in the cube
+        incomplete = facts["year"].isna() | facts["month"].isna()
+        self.incomplete_files = set(facts.loc[incomplete, "file"].unique())
+        self.file_years = facts.groupby("file", observed=True)["year"].unique().to_dict()
+        # value columns of a file holding whole numbers only, the table mixes files and stores them as floats
+        whole_numbers = facts[values].notna() & (facts[values] % 1 == 0)
+        self.whole_number_values = whole_numbers.groupby(facts["file"], observed=True).all()
+
+        self.quarterly_costs = {file: quarterly_sums(df, year_col, month_col) for file, (df, year_col, month_col) in cost_frames.items()}
+
+    def fits(self, file: str, year: int) -> bool:
+        # all rows of the file are in the cube and belong to the given year
+        years = self.file_years.get(file)
+        return file not in self.incomplete_files and years is not None and len(years) == 1 and years[0] == year
+
+    '''
+    Units sold and sales of a file by "month", "quarter" or "year", for a single material or all materials.
+    Returns None if the cube can not answer the request.
+    '''
+    def sales(self, file: str, year: int, by: str = "month", material: str = None) -> pd.DataFrame:
+        if not self.fits(file, year):
+            return None
+        if material:
+            if by != "month":
+                return None
+            try:
+                result = self.by_material.xs((file, year), level=["file", "year"])
+                result = result.xs(str(material).lower(), level="material")
+            except KeyError:
+                return None
+        else:
+            table = {"month": self.by_month, "quarter": self.by_quarter, "year": self.by_year}[by]
+            try:
+                result = table.xs(file, level="file")
+                result = result.xs(year, level="year") if by != "year" else result.loc[[year]]
+            except KeyError:
+                return None
+        return result.reset_index() if len(result) > 0 else None
+
+    def is_integer(self, file: str, value: str) -> bool:
+        # whether the sums of a value ("units_sold" or "sales") of a file are whole numbers like in the raw data
+        return file in self.whole_number_values.index and bool(self.whole_number_values.loc[file, value])
+
+    '''
+    Average of a column of a cost file in a quarter. Returns None if there are no rows in this quarter
+    and raises KeyError if the cube can not answer the request.
+    '''
+    def quarterly_mean(self, file: str, column: str, year: int, quarter: int) -> float:
+        sums = self.quarterly_costs[file]
+        if sums is None or column not in sums.columns.get_level_values(0):
+            raise KeyError(column)
+        if (year, quarter) not in sums.index:
+            return None
+        return sums.loc[(year, quarter), (column, "sum")] / sums.loc[(year, quarter), (column, "count")]
+
+
+def quarterly_sums(df: pd.DataFrame, year_col: str, month_col: str) -> pd.DataFrame:
+    if not pd.api.types.is_integer_dtype(df[year_col]) or not pd.api.types.is_integer_dtype(df[month_col]):
+        return None # invalid years or months, only the raw data can be used
+    columns = [col for col in df.select_dtypes(include=np.number).columns if col not in (year_col, month_col)]
+    quarter = ((df[month_col] - 1) // 3 + 1).rename("quarter")
+    return df.groupby([df[year_col].rename("year"), quarter])[columns].agg(["sum", "count"])
+
+def build_rollup_cube(files: list, metadata: dict, data_frames: LazyDataFrames) -> RollupCube:
+    def is_cost_file(file):
+        mt = metadata[file]
+        columns = mt[MetadataType.COLUMNS]
+        return str(mt[MetadataType.TYPE]).lower() == "costs_per_unit" and ColumnType.YEAR in columns and ColumnType.MONTH in columns
+
+    facts = get_sales_facts(metadata, data_frames)
+    cost_files = list(filter(is_cost_file, files))
+    data_frames.preload(cost_files)
+    cost_frames = {}
+    for file in cost_files:
+        columns = metadata[file][MetadataType.COLUMNS]
+        cost_frames[file] = (data_frames[file], columns[ColumnType.YEAR], columns[ColumnType.MONTH])
+    return RollupCube(facts, cost_frames)
+
+'''
+Get the rollup cube of the sales and cost files among the files returned by get_data
+'''
+def get_rollup_cube(metadata: dict, data_frames: LazyDataFrames) -> RollupCube:
+    return data_cache.derived("rollup_cube", build_rollup_cube, metadata, data_frames)
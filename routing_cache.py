@@ -0,0 +1,193 @@
+import os
+import re
+import threading
+import importlib
+import numpy as np
+
+ROUTING_CACHE = os.getenv("ROUTING_CACHE", "true").lower() == "true"
+ROUTING_CACHE_THRESHOLD = float(os.getenv("ROUTING_CACHE_THRESHOLD", "0.8")) # cosine similarity of the prompt embeddings
+ROUTING_CACHE_MAX_ENTRIES = int(os.getenv("ROUTING_CACHE_MAX_ENTRIES", "1000"))
+
+COUNTRIES = {
+    "CH": ["switzerland", "swiss"],
+    "DE": ["germany", "german"],
+    "FR": ["france", "french"],
+    "US": ["usa", "united states", "america", "american"],
+    "ES": ["spain", "spanish"],
+    "global": ["global", "globally", "worldwide", "all countries"],
+}
+CURRENCIES = {
+    "CHF": ["chf", "franc", "francs"],
+    "USD": ["usd", "dollar", "dollars", "$"],
+    "EUR": ["eur", "euro", "euros", "€"],
+}
+MONTHS = ["january", "february", "march", "april", "may", "june", "july", "august", "september", "october", "november", "december"]
+NUMBER_WORDS = ["one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten", "eleven", "twelve"]
+# plots and plot types, what to plot and month ranges like "first half"
+PLOT_WORDS = ["plot", "chart", "graph", "line", "bar", "sales", "units", "both", "half"]
+# words that do not change the meaning of a prompt, every other word of a new prompt has to be in the cached prompt
+STOP_WORDS = {
+    "a", "an", "the", "of", "in", "for", "from", "to", "and", "on", "at", "by", "per", "with", "all", "each", "every",
+    "what", "which", "who", "how", "much", "many", "is", "are", "was", "were", "do", "does", "did", "can", "could", "would",
+    "you", "me", "i", "my", "we", "our", "please", "show", "give", "get", "return", "tell", "list", "find", "there",
+}
+
+
+def contains_word(text: str, word: str) -> bool:
+    return re.search(rf"(?<!\w){re.escape(word)}(?!\w)", text) is not None
+
+'''
+Entities of a prompt that change the parameters of a function call: numbers (years, months, also as words), quarters,
+months, countries, currencies and the plot options. Country codes are only matched in upper case ("US" but not "us").
+'''
+def extract_entities(prompt: str) -> dict:
+    text = prompt.lower()
+    return {
+        "numbers": {float(number) for number in re.findall(r"\d+(?:\.\d+)?", prompt)}
+                   | {float(NUMBER_WORDS.index(word) + 1) for word in NUMBER_WORDS if contains_word(text, word)},
+        "quarters": set(re.findall(r"\bq([1-4])\b", text)),
+        "months": {month for month in MONTHS if contains_word(text, month) or contains_word(text, month[:3])},
+        "countries": {code for code, names in COUNTRIES.items()
+                      if contains_word(prompt, code) or any(contains_word(text, name) for name in names)},
+        "currencies": {code for code, names in CURRENCIES.items() if any(contains_word(text, name) for name in names)},
+        "plot": {word for word in PLOT_WORDS if contains_word(text, word)},
+    }
+
+def entity_words() -> set:
+    # words of the entities, a prompt may name them differently (e.g. "CH" and "Switzerland") as long as the entities are equal
+    names = [name for names in list(COUNTRIES.values()) + list(CURRENCIES.values()) for name in names]
+    names += list(COUNTRIES.keys()) + list(CURRENCIES.keys()) + MONTHS + [month[:3] for month in MONTHS] + NUMBER_WORDS
+    return {word for name in names for word in re.findall(r"\w+", name.lower())}
+
+ENTITY_WORDS = entity_words()
+
+def content_words(prompt: str) -> set:
+    return {word for word in re.findall(r"\w+", prompt.lower())
+            if word not in STOP_WORDS and word not in ENTITY_WORDS and not word.isdigit() and not re.fullmatch(r"q[1-4]", word)}
+
+def is_entity_value(value: str) -> bool:
+    return value in COUNTRIES or value.upper() in CURRENCIES or re.fullmatch(r"\d+(?:\.\d+)?|[qQ][1-4]", value) is not None
+
+def first_position(prompt: str, value: str) -> int:
+    match = re.search(rf"(?<!\w){re.escape(value.lower())}(?!\w)", prompt.lower())
+    return match.start() if match else -1
+
+'''
+A parameter value is backed by a prompt if it is one of its entities (e.g. "CH" for "Switzerland", 6 for "June" or "six")
+or appears literally in it (e.g. materials and supplier names). Values inferred from other wording (e.g. month_to 6 for
+"first half") are not backed, decisions with such values are not cached because the inference can not be checked.
+'''
+def is_backed(value, prompt: str, entities: dict) -> bool:
+    if value is None or str(value).strip() == "":
+        return True
+    value = str(value).strip()
+    if re.fullmatch(r"\d+(?:\.\d+)?", value):
+        number = float(value)
+        return number in entities["numbers"] or any(MONTHS.index(month) + 1 == number for month in entities["months"])
+    if re.fullmatch(r"[qQ][1-4]", value):
+        return value[1] in entities["quarters"]
+    if value in COUNTRIES:
+        return value in entities["countries"]
+    if value.upper() in CURRENCIES:
+        return value.upper() in entities["currencies"]
+    return contains_word(prompt.lower(), value.lower())
+
+
+class RoutingDecision():
+    def __init__(self, prompt: str, function_name: str, parameters: dict, defaults: dict = None):
+        self.prompt = prompt
+        self.function_name = function_name
+        self.parameters = dict(parameters)
+        self.defaults = defaults or {} # default values of the function, they are used whenever the prompt does not say otherwise
+        self.entities = extract_entities(prompt)
+        self.words = content_words(prompt)
+        self.literal_order = self.literals_in_order(prompt)
+
+    def is_default(self, name: str, value) -> bool:
+        return name in self.defaults and str(self.defaults[name]) == str(value)
+
+    def is_backed_by(self, prompt: str, entities: dict) -> bool:
+        return all(self.is_default(name, value) or is_backed(value, prompt, entities) for name, value in self.parameters.items())
+
+    def literals_in_order(self, prompt: str) -> list:
+        # parameters taken literally from the prompt, in the order their values appear in it
+        # (e.g. supplier_name_from before supplier_name_to for "from A to B")
+        positions = {}
+        for name, value in self.parameters.items():
+            value = str(value).strip()
+            if not self.is_default(name, value) and not is_entity_value(value):
+                position = first_position(prompt, value)
+                if position >= 0:
+                    positions[name] = position
+        return sorted(positions, key=positions.get)
+
+    def matches(self, prompt: str, entities: dict) -> bool:
+        # a new prompt asking for something the cached prompt did not (e.g. a material or a plot) needs a new decision
+        return (entities == self.entities and content_words(prompt) <= self.words and self.is_backed_by(prompt, entities)
+                and self.literals_in_order(prompt) == self.literal_order)
+
+
+'''
+Semantic cache of the function selection of the FunctionAgent. The decision (function and parameters) for a prompt
+is reused for a new prompt if their embeddings are at least ROUTING_CACHE_THRESHOLD similar (cosine) and the new prompt
+has the same entities (numbers, quarters, months, countries, currencies, plot options) and backs every parameter value
+(see is_backed) in the same order, and has no words the cached prompt does not have (apart from STOP_WORDS and other
+names of the entities). So "total sales of CH per month in 2023" reuses the decision for "total sales Switzerland 2023 per month"
+but "total sales of CH per month in 2022" and "total sales of wood in CH per month in 2023" do not. Default values of the
+function are always backed, a prompt asking for another value has other entities. Decisions with values that are not
+backed by their own prompt are not cached.
+'''
+class RoutingCache():
+    def __init__(self, dimension: int, threshold: float = ROUTING_CACHE_THRESHOLD, max_entries: int = ROUTING_CACHE_MAX_ENTRIES):
+        self.dimension = dimension
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.faiss = importlib.import_module("faiss") # imported with the first cache, not when the agent is imported
+        self.index = self.faiss.IndexFlatIP(dimension) # inner product of normalized embeddings is the cosine similarity
+        self.decisions = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def normalized(self, embedding) -> np.ndarray:
+        embedding = np.array(embedding, dtype="float32").reshape(1, self.dimension)
+        self.faiss.normalize_L2(embedding)
+        return embedding
+
+    def lookup(self, prompt: str, embedding, candidates: int = 5) -> RoutingDecision:
+        embedding = self.normalized(embedding)
+        entities = extract_entities(prompt)
+        with self._lock:
+            if self.decisions:
+                similarities, positions = self.index.search(embedding, min(candidates, len(self.decisions)))
+                for similarity, position in zip(similarities[0], positions[0]):
+                    if similarity < self.threshold:
+                        break
+                    decision = self.decisions[position]
+                    if decision.matches(prompt, entities):
+                        self.hits += 1
+                        return decision
+            self.misses += 1
+            return None
+
+    def add(self, prompt: str, embedding, function_name: str, parameters: dict, defaults: dict = None) -> bool:
+        decision = RoutingDecision(prompt, function_name, parameters, defaults)
+        if not decision.is_backed_by(prompt, decision.entities):
+            return False
+        embedding = self.normalized(embedding)
+        with self._lock:
+            if len(self.decisions) >= self.max_entries:
+                # keep the newer half, a flat index can not remove single entries without renumbering
+                self.decisions = self.decisions[len(self.decisions) // 2:]
+                kept = self.index.reconstruct_n(self.index.ntotal - len(self.decisions), len(self.decisions))
+                self.index.reset()
+                self.index.add(kept)
+            self.decisions.append(decision)
+            self.index.add(embedding)
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            requests = self.hits + self.misses
+            return {"entries": len(self.decisions), "hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / requests if requests else 0.0}
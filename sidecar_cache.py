@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import pandas as pd
+
+CACHE_DIR = os.getenv("GEDA_CACHE_DIR", os.path.join(os.getcwd(), ".geda_cache"))
+SIDECAR_MAX_MB = float(os.getenv("SIDECAR_MAX_MB", "2048")) # size of all sidecars, 0 disables the limit
+SIDECAR_MAX_AGE_DAYS = float(os.getenv("SIDECAR_MAX_AGE_DAYS", "30")) # sidecars not used for this long are removed, 0 keeps them
+
+
+'''
+Checksum-addressed on-disk cache of ingested data frames in the Arrow IPC (Feather) format.
+Files are written uncompressed so they can be memory-mapped on reload, which skips parsing the workbook entirely.
+Every entry is identified by the checksum of the source file and a stage ("parsed" or "preprocessed"),
+additional information like the info text is stored in the schema metadata.
+The cache is disabled if pyarrow is not installed.
+Loading a sidecar marks it as used (mtime), after every write the sidecars not used for max_age_seconds and then the
+least recently used ones beyond max_bytes are removed, so the cache does not grow with every uploaded file version.
+'''
+class SidecarCache():
+    def __init__(self, cache_dir: str = CACHE_DIR, max_bytes: float = None, max_age_seconds: float = None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes # None keeps all sidecars
+        self.max_age_seconds = max_age_seconds
+        try:
+            import pyarrow  # noqa: F401
+            self.enabled = True
+        except ImportError:
+            print("pyarrow is not installed, the sidecar cache is disabled.")
+            self.enabled = False
+
+    def path(self, checksum: str, stage: str) -> str:
+        return os.path.join(self.cache_dir, f"{checksum}.{stage}.arrow")
+
+    def exists(self, checksum: str, stage: str) -> bool:
+        return self.enabled and bool(checksum) and os.path.exists(self.path(checksum, stage))
+
+    def load(self, checksum: str, stage: str) -> (pd.DataFrame, dict):
+        if not self.enabled or not checksum:
+            return None, None
+        path = self.path(checksum, stage)
+        if not os.path.exists(path):
+            return None, None
+
+        from pyarrow import feather
+        try:
+            os.utime(path) # least recently used sidecars are removed first
+            table = feather.read_table(path, memory_map=True)
+            info = json.loads((table.schema.metadata or {}).get(b"geda", b"{}"))
+            return table.to_pandas(), info
+        except Exception as e:
+            print(f"Could not load sidecar {path}: {e}")
+            return None, None
+
+    def save(self, checksum: str, stage: str, df: pd.DataFrame, info: dict = None) -> bool:
+        # returns whether the sidecar was written
+        if not self.enabled or not checksum:
+            return False
+        import pyarrow as pa
+        from pyarrow import feather
+
+        path = self.path(checksum, stage)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            schema_metadata = dict(table.schema.metadata or {})
+            schema_metadata[b"geda"] = json.dumps(info or {}).encode()
+            table = table.replace_schema_metadata(schema_metadata)
+
+            os.makedirs(self.cache_dir, exist_ok=True)
+            feather.write_feather(table, tmp_path, compression="uncompressed")
+            os.replace(tmp_path, path) # readers never see a partially written file
+        except Exception as e: # e.g. columns with mixed types can not be stored in Arrow
+            print(f"Could not write sidecar for {checksum} ({stage}): {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        self.prune(keep=path)
+        return True
+
+    def delete(self, checksum: str, stage: str) -> None:
+        if self.enabled and checksum:
+            self.remove(self.path(checksum, stage))
+
+    def remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError: # removed by another process or still memory-mapped (Windows)
+            pass
+
+    def prune(self, keep: str = None) -> None:
+        if not os.path.exists(self.cache_dir):
+            return
+        sidecars = []
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith(".arrow"):
+                path = os.path.join(self.cache_dir, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                sidecars.append((stat.st_mtime, stat.st_size, path))
+
+        now = time.time()
+        total_size = sum(size for _, size, _ in sidecars)
+        for mtime, size, path in sorted(sidecars): # least recently used first
+            expired = self.max_age_seconds is not None and now - mtime > self.max_age_seconds
+            too_large = self.max_bytes is not None and total_size > self.max_bytes
+            if path != keep and (expired or too_large):
+                print(f"Removing sidecar {path} from the cache.")
+                self.remove(path)
+                total_size -= size
+
+    def clear(self) -> None:
+        if not os.path.exists(self.cache_dir):
+            return
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith(".arrow"):
+                os.remove(os.path.join(self.cache_dir, filename))
+
+
+sidecar_cache = SidecarCache(
+    max_bytes=SIDECAR_MAX_MB * 1024 * 1024 if SIDECAR_MAX_MB > 0 else None,
+    max_age_seconds=SIDECAR_MAX_AGE_DAYS * 24 * 60 * 60 if SIDECAR_MAX_AGE_DAYS > 0 else None,
+)
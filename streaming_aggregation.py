@@ -0,0 +1,40 @@
+import pandas as pd
+
+AGGREGATIONS = ["sum", "count", "min", "max"]
+
+# how the aggregates of two chunks are combined
+COMBINATIONS = {"sum": "sum", "count": "sum", "min": "min", "max": "max"}
+
+
+'''
+Incremental group by aggregation over chunks of rows.
+Every chunk is reduced to sum, count (of non-missing values), min and max of the value columns per group key
+(missing keys are a group as well) and merged into the running result, so memory only grows with the number
+of groups and not with the number of rows.
+'''
+class GroupAggregator():
+    def __init__(self, keys: list, values: list):
+        self.keys = keys
+        self.values = values
+        self.rows = 0
+        self._result = None
+
+    def update(self, chunk: pd.DataFrame) -> None:
+        self.rows += len(chunk)
+        aggregated = chunk.groupby(self.keys, dropna=False)[self.values].agg(AGGREGATIONS)
+        if self._result is None:
+            self._result = aggregated
+        else:
+            combined = pd.concat([self._result, aggregated])
+            self._result = combined.groupby(level=self.keys, dropna=False).agg(
+                {(value, aggregation): COMBINATIONS[aggregation] for value in self.values for aggregation in AGGREGATIONS}
+            )
+
+    '''
+    The aggregates per group, with a column (value, aggregation) for every value column and aggregation
+    '''
+    def result(self) -> pd.DataFrame:
+        if self._result is None:
+            columns = pd.MultiIndex.from_product([self.values, AGGREGATIONS])
+            return pd.DataFrame(columns=columns, index=pd.MultiIndex.from_tuples([], names=self.keys))
+        return self._result